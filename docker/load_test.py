@@ -0,0 +1,386 @@
+#
+# Author : Samuel Souk-Aloun
+#
+# Copyright 2020 GeoLabs SARL. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including with
+# out limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Load generator for the ZOO-Kernel, submitting executions at a given
+# arrival rate through OGC API - Processes (default) or WPS 1.0.0, in
+# asynchronous or synchronous mode, and reporting the submit latency, the
+# time to complete and the throughput.
+#
+# example usage:
+# python load_test.py --url http://localhost/ogc-api --process longProcess \
+#     --inputs '{"a": "toto"}' --rate 5 --requests 200 --csv runs.csv
+#
+
+import argparse
+import asyncio
+import csv
+import json
+import math
+import random
+import sys
+import time
+
+from xml.etree import ElementTree
+
+import httpx
+
+FINAL_STATUSES = ["successful", "failed", "dismissed"]
+WPS_NS = dict(wps="http://www.opengis.net/wps/1.0.0")
+
+
+class Run:
+    """
+    Measures of a single execution, times are in seconds.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.submitted = None
+        self.accepted = None
+        self.completed = None
+        self.http_status = None
+        self.status = None
+        self.job_id = None
+        self.error = None
+
+    @property
+    def submit_latency(self):
+        if self.accepted is None:
+            return None
+        return self.accepted - self.submitted
+
+    @property
+    def time_to_complete(self):
+        if self.completed is None:
+            return None
+        return self.completed - self.submitted
+
+    def as_dict(self):
+        return dict(
+            index=self.index,
+            job_id=self.job_id,
+            status=self.status,
+            http_status=self.http_status,
+            submit_latency=self.submit_latency,
+            time_to_complete=self.time_to_complete,
+            error=self.error,
+        )
+
+
+class OgcApiClient:
+    """
+    Execute a process through OGC API - Processes, /processes/{id}/execution
+    """
+
+    def __init__(self, args, client):
+        self.args = args
+        self.client = client
+        self.url = args.url.rstrip("/") + "/processes/" + args.process + "/execution"
+
+    async def submit(self, run):
+        headers = {"Accept": "application/json"}
+        if self.args.mode == "async":
+            headers["Prefer"] = "respond-async"
+        body = {"inputs": self.args.inputs}
+        if self.args.outputs is not None:
+            body["outputs"] = self.args.outputs
+        r = await self.client.post(self.url, json=body, headers=headers)
+        run.accepted = time.monotonic()
+        run.http_status = r.status_code
+        if r.status_code >= 400:
+            run.status = "failed"
+            run.error = r.text[:200]
+            return None
+        if self.args.mode == "sync":
+            run.status = "successful"
+            return None
+        location = r.headers.get("Location")
+        if location is None:
+            run.status = "failed"
+            run.error = "No Location header in the response"
+            return None
+        run.job_id = location.rstrip("/").split("/")[-1]
+        return location
+
+    async def poll(self, run, location):
+        r = await self.client.get(location, headers={"Accept": "application/json"})
+        if r.status_code >= 400:
+            run.status = "failed"
+            run.error = r.text[:200]
+            return True
+        status = r.json().get("status")
+        if status in FINAL_STATUSES:
+            run.status = status
+            return True
+        return False
+
+
+class WpsClient:
+    """
+    Execute a process through WPS 1.0.0 Execute, polling its statusLocation
+    """
+
+    def __init__(self, args, client):
+        self.args = args
+        self.client = client
+
+    async def submit(self, run):
+        params = dict(
+            request="Execute",
+            service="WPS",
+            version="1.0.0",
+            Identifier=self.args.process,
+            DataInputs=";".join(
+                "%s=%s" % (k, v) for k, v in self.args.inputs.items()
+            ),
+            ResponseDocument="Result",
+        )
+        if self.args.mode == "async":
+            params.update(storeExecuteResponse="true", status="true")
+        r = await self.client.get(self.args.url, params=params)
+        run.accepted = time.monotonic()
+        run.http_status = r.status_code
+        try:
+            root = ElementTree.fromstring(r.content)
+        except ElementTree.ParseError as e:
+            run.status = "failed"
+            run.error = str(e)
+            return None
+        if self.args.mode == "sync" or "statusLocation" not in root.attrib:
+            run.status = self.status(root)
+            return None
+        location = root.attrib["statusLocation"]
+        run.job_id = location.split("/")[-1]
+        return location
+
+    def status(self, root):
+        if root.find("wps:Status/wps:ProcessSucceeded", WPS_NS) is not None:
+            return "successful"
+        if root.find("wps:Status/wps:ProcessFailed", WPS_NS) is not None:
+            return "failed"
+        if root.tag.endswith("ExceptionReport"):
+            return "failed"
+        return None
+
+    async def poll(self, run, location):
+        r = await self.client.get(location)
+        try:
+            status = self.status(ElementTree.fromstring(r.content))
+        except ElementTree.ParseError:
+            # The status file may be read while being written
+            return False
+        if status is not None:
+            run.status = status
+            return True
+        return False
+
+
+async def execute(args, api, run):
+    run.submitted = time.monotonic()
+    try:
+        location = await api.submit(run)
+        if location is not None:
+            deadline = run.submitted + args.timeout
+            while not await api.poll(run, location):
+                if time.monotonic() > deadline:
+                    run.status = "timeout"
+                    return
+                await asyncio.sleep(args.poll)
+        if run.status is not None and run.status != "timeout":
+            run.completed = time.monotonic()
+    except httpx.HTTPError as e:
+        run.status = "failed"
+        run.error = "%s: %s" % (type(e).__name__, e)
+
+
+async def generate(args):
+    """
+    Submit the executions at the requested arrival rate, without waiting for
+    the previous ones to complete (open loop).
+    """
+    limits = httpx.Limits(
+        max_connections=args.connections, max_keepalive_connections=args.connections
+    )
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        api = OgcApiClient(args, client) if args.api == "ogc" else WpsClient(args, client)
+        runs = []
+        tasks = []
+        start = time.monotonic()
+        next_arrival = start
+        for i in range(args.requests):
+            if args.duration is not None and time.monotonic() - start > args.duration:
+                break
+            delay = next_arrival - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            run = Run(i)
+            runs.append(run)
+            tasks.append(asyncio.create_task(execute(args, api, run)))
+            if args.rate > 0:
+                if args.poisson:
+                    next_arrival += random.expovariate(args.rate)
+                else:
+                    next_arrival += 1.0 / args.rate
+        await asyncio.gather(*tasks)
+        return runs, time.monotonic() - start
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a sorted list.
+    """
+    if not values:
+        return None
+    rank = max(1, math.ceil(p / 100.0 * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+
+def histogram(values, buckets=10):
+    if not values:
+        return []
+    low, high = values[0], values[-1]
+    width = (high - low) / buckets or 1.0
+    counts = [0] * buckets
+    for v in values:
+        counts[min(int((v - low) / width), buckets - 1)] += 1
+    return [
+        dict(low=low + i * width, high=low + (i + 1) * width, count=counts[i])
+        for i in range(buckets)
+    ]
+
+
+def describe(values):
+    values = sorted(v for v in values if v is not None)
+    return dict(
+        count=len(values),
+        min=values[0] if values else None,
+        mean=sum(values) / len(values) if values else None,
+        p50=percentile(values, 50),
+        p95=percentile(values, 95),
+        p99=percentile(values, 99),
+        max=values[-1] if values else None,
+        histogram=histogram(values),
+    )
+
+
+def summarize(args, runs, elapsed):
+    statuses = {}
+    for run in runs:
+        statuses[run.status] = statuses.get(run.status, 0) + 1
+    completed = [r for r in runs if r.status == "successful"]
+    return dict(
+        api=args.api,
+        mode=args.mode,
+        process=args.process,
+        rate=args.rate,
+        requests=len(runs),
+        elapsed=elapsed,
+        statuses=statuses,
+        throughput=len(completed) / elapsed if elapsed > 0 else None,
+        submit_latency=describe([r.submit_latency for r in runs]),
+        time_to_complete=describe([r.time_to_complete for r in completed]),
+    )
+
+
+def print_summary(summary):
+    print(
+        "%d requests (%s, %s) in %.2fs: %s"
+        % (
+            summary["requests"],
+            summary["api"],
+            summary["mode"],
+            summary["elapsed"],
+            ", ".join("%s=%d" % (k, v) for k, v in summary["statuses"].items()),
+        )
+    )
+    if summary["throughput"] is not None:
+        print("throughput: %.3f completed/s" % summary["throughput"])
+    for name in ["submit_latency", "time_to_complete"]:
+        d = summary[name]
+        if d["count"] == 0:
+            continue
+        print(
+            "%s: p50=%.3fs p95=%.3fs p99=%.3fs min=%.3fs max=%.3fs"
+            % (name, d["p50"], d["p95"], d["p99"], d["min"], d["max"])
+        )
+        peak = max(b["count"] for b in d["histogram"])
+        for b in d["histogram"]:
+            print(
+                "  %8.3f - %8.3f %6d %s"
+                % (b["low"], b["high"], b["count"], "#" * int(40 * b["count"] / peak))
+            )
+
+
+def write_csv(path, runs):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(Run(0).as_dict().keys()))
+        writer.writeheader()
+        for run in runs:
+            writer.writerow(run.as_dict())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ZOO-Kernel load generator")
+    parser.add_argument("--url", default="http://localhost/ogc-api",
+                        help="OGC API root or zoo_loader.cgi URL for WPS")
+    parser.add_argument("--api", choices=["ogc", "wps"], default="ogc")
+    parser.add_argument("--process", default="longProcess")
+    parser.add_argument("--inputs", type=json.loads, default={"a": "toto"},
+                        help="JSON object of the execution inputs")
+    parser.add_argument("--outputs", type=json.loads, default=None,
+                        help="JSON object of the requested outputs (OGC API)")
+    parser.add_argument("--mode", choices=["async", "sync"], default="async")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="submissions per second, 0 to submit all at once")
+    parser.add_argument("--poisson", action="store_true",
+                        help="exponentially distributed inter-arrival times")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=None,
+                        help="stop submitting after this many seconds")
+    parser.add_argument("--connections", type=int, default=50,
+                        help="size of the HTTP connection pool")
+    parser.add_argument("--poll", type=float, default=1.0,
+                        help="status polling interval in seconds")
+    parser.add_argument("--timeout", type=float, default=600.0,
+                        help="seconds before an execution is considered lost")
+    parser.add_argument("--csv", help="write the measures of each run to this file")
+    parser.add_argument("--json", help="write the summary and the runs to this file")
+    args = parser.parse_args()
+    if args.api == "wps" and args.url == parser.get_default("url"):
+        args.url = "http://localhost/cgi-bin/zoo_loader.cgi"
+
+    runs, elapsed = asyncio.run(generate(args))
+    summary = summarize(args, runs, elapsed)
+    print_summary(summary)
+    if args.csv:
+        write_csv(args.csv, runs)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dict(summary=summary, runs=[r.as_dict() for r in runs]), f, indent=2)
+    return 0 if summary["statuses"].get("successful", 0) == len(runs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
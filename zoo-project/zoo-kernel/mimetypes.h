@@ -28,7 +28,7 @@ typedef enum MimeTypes {
 	 M_Extension
 } mimetype;
 
-#define NUM_MIME_TYPES 767
+#define NUM_MIME_TYPES 769
 
 /*
  * This array has been constructed based on the
@@ -55,6 +55,7 @@ const char* const MIME[NUM_MIME_TYPES][2] = {
 	{ "application/emma+xml", "emma" },
 	{ "application/epub+zip", "epub" },
 	{ "application/exi", "exi" },
+	{ "application/flatgeobuf", "fgb" },
 	{ "application/font-tdpfr", "pfr" },
 	{ "application/gml+xml", "gml" },
 	{ "application/gpx+xml", "gpx" },
@@ -167,6 +168,7 @@ const char* const MIME[NUM_MIME_TYPES][2] = {
 	{ "application/vnd.anser-web-certificate-issue-initiation", "cii" },
 	{ "application/vnd.anser-web-funds-transfer-initiation", "fti" },
 	{ "application/vnd.antix.game-component", "atx" },
+	{ "application/vnd.apache.parquet", "parquet" },
 	{ "application/vnd.apple.installer+xml", "mpkg" },
 	{ "application/vnd.apple.mpegurl", "m3u8" },
 	{ "application/vnd.aristanetworks.swi", "swi" },
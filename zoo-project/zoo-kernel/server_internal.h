@@ -50,6 +50,7 @@ extern "C" {
   char *base64(const char*,int);
   char *base64d(const char*,int,int*);
   void readBase64(map **);
+  char *url_encode(char *);
   char *url_decode(char *);
   int getVersionId(const char*);
   void readGeneratedFile(maps*,map*,char*);
@@ -39,6 +39,7 @@
 
 #include "service_callback.h"
 #include "service_json.h"
+#include "server_internal.h"
 #include "sqlapi.h"
 #include <ulinet.h>
 #if defined(USE_CALLBACK) || defined(USE_MS)
@@ -604,7 +605,22 @@ extern "C" {
 	url=getMapFromMaps(conf,"subscriber","failedUri");
     if(url==NULL)
       return false;
-    map* url0=createMap("url",url->value);
+    map* url0=NULL;
+    map* pmPublisherUrl=getMapFromMaps(conf,"openapi","publisherUrl");
+    if(pmPublisherUrl!=NULL &&
+       strncmp(url->value,pmPublisherUrl->value,strlen(pmPublisherUrl->value))==0){
+      // Let the publisher forward the status to the channel of the
+      // authenticated user running the job. The user is always set last so
+      // that a value given by the client in the URL is never used.
+      map* pmUser=getMapFromMaps(conf,"auth_env","user");
+      char* pcaUser=url_encode(pmUser!=NULL?pmUser->value:(char*)"");
+      char* pcaUrl=(char*)malloc((strlen(url->value)+strlen(pcaUser)+7)*sizeof(char));
+      sprintf(pcaUrl,"%s&user=%s",url->value,pcaUser);
+      url0=createMap("url",pcaUrl);
+      free(pcaUser);
+      free(pcaUrl);
+    }else
+      url0=createMap("url",url->value);
     map* sname=getMapFromMaps(conf,"lenv","identifier");
     if(sname!=NULL && isProhibited(conf,sname->value))
       return false;
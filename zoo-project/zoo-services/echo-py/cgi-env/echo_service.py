@@ -28,6 +28,41 @@ import sys
 import osgeo.ogr
 import osgeo.ogr as ogr
 
+def copyDataSource(ds,driverName,path):
+    """
+    Copy the layers of ds to a new datasource at path, through Arrow record
+    batches when both pyarrow and the Arrow support of the GDAL bindings
+    (3.8 or later) are available, with CopyDataSource otherwise.
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        pyarrow=None
+    if pyarrow is None or not(hasattr(ogr.Layer,"WritePyArrow")):
+        return ogr.GetDriverByName(driverName).CopyDataSource(ds, path)
+    out_ds=ogr.GetDriverByName(driverName).CreateDataSource(path)
+    if out_ds is None:
+        return None
+    for i in range(ds.GetLayerCount()):
+        lyr=ds.GetLayer(i)
+        out_lyr=out_ds.CreateLayer(lyr.GetName(),lyr.GetSpatialRef(),lyr.GetGeomType())
+        if out_lyr is None:
+            return None
+        stream=lyr.GetArrowStreamAsPyArrow(options=["INCLUDE_FID=NO","GEOMETRY_ENCODING=WKB"])
+        options=[]
+        geometryName=None
+        if lyr.GetGeomType()!=ogr.wkbNone:
+            geometryName=lyr.GetGeometryColumn() or "wkb_geometry"
+            options=["GEOMETRY_NAME="+geometryName]
+        for field in stream.schema:
+            if field.name!=geometryName:
+                out_lyr.CreateFieldFromPyArrowSchema(field)
+        for batch in stream:
+            out_lyr.WritePyArrow(batch,options=options)
+        # The stream must be released before its layer
+        stream=None
+    return out_ds
+
 def echo(conf,inputs,outputs):
     print(inputs,file=sys.stderr)
     if inputs["a"]["inRequest"]=="false" and inputs["a"]["inRequest"]=="false" and inputs["a"]["inRequest"]=="false" :
@@ -52,12 +87,12 @@ def echo(conf,inputs,outputs):
                 ds = osgeo.ogr.Open(inputs["b"]["cache_file"])
                 path=""
                 if outputs["b"]["mimeType"]=="application/json":
-                    out_ds  = ogr.GetDriverByName("GeoJSON").CopyDataSource(ds, conf["main"]["tmpPath"]+"/result-"+conf["lenv"]["usid"]+"_value.json")
+                    out_ds  = copyDataSource(ds, "GeoJSON", conf["main"]["tmpPath"]+"/result-"+conf["lenv"]["usid"]+"_value.json")
                     if out_ds is None:
                         raise Exception("Unable to parse GeoJSON")
                     path=conf["main"]["tmpPath"]+"/result-"+conf["lenv"]["usid"]+"_value.json"
                 else:
-                    out_ds  = ogr.GetDriverByName("GML").CopyDataSource(ds, conf["main"]["tmpPath"]+"/result-"+conf["lenv"]["usid"]+".xml")
+                    out_ds  = copyDataSource(ds, "GML", conf["main"]["tmpPath"]+"/result-"+conf["lenv"]["usid"]+".xml")
                     if out_ds is None:
                         raise Exception("Unable to parse GML")
                     path=conf["main"]["tmpPath"]+"/result-"+conf["lenv"]["usid"]+".xml"
@@ -0,0 +1,300 @@
+#
+# Copyright 2026 GeoLabs SARL. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including with
+# out limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Throughput benchmark of the ogr_sp vector services, run in-process
+# outside of the ZOO-Kernel. A corpus of synthetic polygon and line layers
+# (1k, 100k and 1M features by default) is generated once in --corpus, then
+# each service is run on each layer for each output format, reporting the
+# time and the number of features per second.
+#
+# example usage:
+# python benchmark.py --corpus /tmp/ogr_sp_corpus --sizes 1000,100000 \
+#     --services BufferPy,CentroidPy --formats geojson,flatgeobuf --json run.json
+#
+
+import argparse
+import csv
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+from osgeo import gdal, ogr, osr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cgi-env"))
+
+try:
+    import zoo
+except ImportError:
+    # The zoo module is provided by the ZOO-Kernel embedding the interpreter
+    zoo = types.ModuleType("zoo")
+    zoo.SERVICE_SUCCEEDED = 3
+    zoo.SERVICE_FAILED = 4
+    zoo._ = lambda message: message
+    sys.modules["zoo"] = zoo
+
+import ogr_sp
+
+# Extent of the corpus, in EPSG:4326 authority order (lat, lon)
+EXTENT = (40.0, 0.0, 50.0, 10.0)
+
+FORMATS = {
+    "gml": dict(mimeType="text/xml; subtype=gml/3.2"),
+    "geojson": dict(mimeType="application/json"),
+    "flatgeobuf": dict(mimeType="application/flatgeobuf"),
+    "geoparquet": dict(mimeType="application/vnd.apache.parquet"),
+}
+
+
+def polygon(rng, x, y, size):
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    vertices = rng.randint(4, 12)
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        radius = size * rng.uniform(0.3, 0.5)
+        ring.AddPoint_2D(x + radius * math.cos(angle), y + radius * math.sin(angle))
+    ring.CloseRings()
+    geom = ogr.Geometry(ogr.wkbPolygon)
+    geom.AddGeometryDirectly(ring)
+    return geom
+
+
+def line(rng, x, y, size):
+    geom = ogr.Geometry(ogr.wkbLineString)
+    for i in range(10):
+        geom.AddPoint_2D(x, y)
+        x += rng.uniform(-size, size) / 4
+        y += rng.uniform(-size, size) / 4
+    return geom
+
+
+def generate_layer(path, kind, count, seed=0):
+    """
+    Write a FlatGeobuf layer of count polygons or lines laid out on a
+    regular grid over EXTENT, with a few attributes.
+    """
+    rng = random.Random(seed)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    ds = ogr.GetDriverByName("FlatGeobuf").CreateDataSource(path + ".tmp.fgb")
+    lyr = ds.CreateLayer(kind, srs, ogr.wkbPolygon if kind == "polygons" else ogr.wkbLineString)
+    lyr.CreateField(ogr.FieldDefn("id", ogr.OFTInteger64))
+    lyr.CreateField(ogr.FieldDefn("name", ogr.OFTString))
+    lyr.CreateField(ogr.FieldDefn("value", ogr.OFTReal))
+    columns = max(1, int(count ** 0.5))
+    size = (EXTENT[2] - EXTENT[0]) / columns
+    build = polygon if kind == "polygons" else line
+    defn = lyr.GetLayerDefn()
+    lyr.StartTransaction()
+    for i in range(count):
+        feature = ogr.Feature(defn)
+        feature.SetField("id", i)
+        feature.SetField("name", "%s %d" % (kind, i))
+        feature.SetField("value", rng.random() * 1000)
+        x = EXTENT[0] + (i % columns + 0.5) * size
+        y = EXTENT[1] + (i // columns % columns + 0.5) * size
+        feature.SetGeometryDirectly(build(rng, x, y, size))
+        lyr.CreateFeature(feature)
+    lyr.CommitTransaction()
+    ds = None
+    os.rename(path + ".tmp.fgb", path)
+
+
+def corpus_layer(args, kind, count):
+    path = os.path.join(args.corpus, "%s_%d.fgb" % (kind, count))
+    if not os.path.exists(path):
+        print("generating %s" % path, file=sys.stderr)
+        generate_layer(path, kind, count)
+    return path
+
+
+def area_of_interest(args):
+    """
+    Polygon covering the south-west quarter of the extent plus a margin,
+    for the clip and filter modes of IntersectionPy.
+    """
+    path = os.path.join(args.corpus, "area.json")
+    if not os.path.exists(path):
+        x0, y0, x1, y1 = EXTENT
+        xm, ym = (x0 + x1) / 2 + 0.37, (y0 + y1) / 2 + 0.41
+        with open(path, "w") as f:
+            f.write(ogr.CreateGeometryFromWkt(
+                "POLYGON ((%f %f, %f %f, %f %f, %f %f, %f %f))"
+                % (x0, y0, xm, y0, xm, ym, x0, ym, x0, y0)).ExportToJson())
+    with open(path) as f:
+        return f.read()
+
+
+def service_runs(args, kind, path):
+    """
+    Return the (label, service, inputs) to run on the layer at path.
+    """
+    layer = dict(cache_file=path, mimeType="application/flatgeobuf")
+    runs = [
+        ("BufferPy", "BufferPy", dict(InputPolygon=layer, BufferDistance=dict(value="0.001"))),
+        ("BoundaryPy", "BoundaryPy", dict(InputPolygon=layer)),
+        ("CentroidPy", "CentroidPy", dict(InputPolygon=layer)),
+        ("ConvexHullPy", "ConvexHullPy", dict(InputPolygon=layer)),
+        ("Clean", "Clean", dict(InputData=layer)),
+        ("TransformService", "TransformService",
+         dict(InputData=layer, SourceCRS=dict(value="EPSG:4326"), TargetCRS=dict(value="EPSG:3857"))),
+    ]
+    area = dict(value=area_of_interest(args), mimeType="application/json")
+    for mode in ["clip", "filter"]:
+        runs.append(("IntersectionPy:" + mode, "IntersectionPy",
+                     dict(InputEntity1=layer, InputEntity2=area, Mode=dict(value=mode))))
+    return [r for r in runs if args.services is None or r[0] in args.services or r[1] in args.services]
+
+
+def run_service(args, service, inputs, output_format, tmp_path, index):
+    conf = {
+        "main": {"tmpPath": tmp_path},
+        "lenv": {"usid": "bench%d" % index, "sid": str(index), "Identifier": service},
+    }
+    if args.workers is not None:
+        ogr_sp.getServiceParameter(conf, "workers")
+        ogr_sp.serviceParameters[service]["workers"] = str(args.workers)
+    output_name = "TransformedData" if service == "TransformService" else "Result"
+    outputs = {output_name: dict(FORMATS[output_format])}
+    start = time.perf_counter()
+    status = getattr(ogr_sp, service)(conf, {k: dict(v) for k, v in inputs.items()}, outputs)
+    elapsed = time.perf_counter() - start
+    generated = outputs[output_name].get("generated_file")
+    size = None
+    if generated is not None and os.path.exists(generated):
+        size = os.path.getsize(generated)
+        ds = ogr.Open(generated)
+        count = ds.GetLayer(0).GetFeatureCount() if ds is not None else None
+        ds = None
+    else:
+        count = None
+    return status, elapsed, size, count
+
+
+def benchmark(args):
+    results = []
+    tmp_path = tempfile.mkdtemp(prefix="ogr_sp_bench_")
+    index = 0
+    try:
+        for count in args.sizes:
+            for kind in args.kinds:
+                path = corpus_layer(args, kind, count)
+                for label, service, inputs in service_runs(args, kind, path):
+                    for output_format in args.formats:
+                        times = []
+                        for i in range(args.repeat):
+                            index += 1
+                            status, elapsed, size, out_count = run_service(
+                                args, service, inputs, output_format, tmp_path, index)
+                            times.append(elapsed)
+                            for name in os.listdir(tmp_path):
+                                os.unlink(os.path.join(tmp_path, name))
+                        best = min(times)
+                        result = dict(
+                            service=label,
+                            layer=kind,
+                            features=count,
+                            format=output_format,
+                            status="successful" if status == zoo.SERVICE_SUCCEEDED else "failed",
+                            min=best,
+                            median=statistics.median(times),
+                            features_per_second=count / best if best > 0 else None,
+                            output_bytes=size,
+                            output_features=out_count,
+                        )
+                        print_result(result)
+                        results.append(result)
+    finally:
+        shutil.rmtree(tmp_path)
+    return results
+
+
+def print_result(result):
+    print(
+        "%-24s %-8s %8d %-10s %-10s %9.3fs %12.0f feat/s %12s bytes"
+        % (
+            result["service"],
+            result["layer"],
+            result["features"],
+            result["format"],
+            result["status"],
+            result["min"],
+            result["features_per_second"] or 0,
+            result["output_bytes"],
+        )
+    )
+    sys.stdout.flush()
+
+
+def environment():
+    versions = dict(python=platform.python_version(), gdal=gdal.__version__)
+    for name in ["shapely", "numpy", "pyarrow", "pyproj"]:
+        try:
+            versions[name] = __import__(name).__version__
+        except ImportError:
+            versions[name] = None
+    return dict(versions=versions, machine=platform.machine(), cpus=os.cpu_count())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ogr_sp vector services benchmark")
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "ogr_sp_corpus"),
+                        help="directory of the synthetic layers, generated if missing")
+    parser.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",")],
+                        default=[1000, 100000, 1000000], help="comma separated numbers of features")
+    parser.add_argument("--kinds", type=lambda v: v.split(","), default=["polygons", "lines"])
+    parser.add_argument("--services", type=lambda v: v.split(","), default=None,
+                        help="comma separated services to run, all by default")
+    parser.add_argument("--formats", type=lambda v: v.split(","), default=list(FORMATS.keys()),
+                        help="comma separated output formats among " + ",".join(FORMATS.keys()))
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each measure, the best is kept")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="override the workers AdditionalParameters of the services")
+    parser.add_argument("--csv", help="write the results to this file")
+    parser.add_argument("--json", help="write the environment and the results to this file")
+    args = parser.parse_args()
+    for output_format in args.formats:
+        if output_format not in FORMATS:
+            parser.error("unknown format " + output_format)
+    os.makedirs(args.corpus, exist_ok=True)
+
+    results = benchmark(args)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()) if results else [])
+            writer.writeheader()
+            writer.writerows(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dict(environment=environment(), results=results), f, indent=2)
+    return 0 if all(r["status"] == "successful" for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
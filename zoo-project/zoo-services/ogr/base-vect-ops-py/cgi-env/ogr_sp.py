@@ -24,33 +24,54 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
-from osgeo import *
-import osgeo.ogr
-import osgeo.gdal
-import libxml2
+import itertools
 import os
 import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import osgeo.gdal
+import osgeo.ogr
+import osgeo.osr
 import zoo
 
-def readFileFromBuffer(data,ext):
+def readLayer(path,batchSize):
+    """
+    Yield the features of the first layer of the datasource at path, in
+    lists of at most batchSize features.
+    """
+    ds = osgeo.ogr.Open(path)
+    if ds is None:
+        print("Unable to open "+path,file=sys.stderr)
+        return
     try:
-        geometry=[]
-        print >> sys.stderr,'/vsimem//temp1'+ext
-        #print >> sys.stderr,data
-        osgeo.gdal.FileFromMemBuffer('/vsimem//temp1'+ext,data)
-        ds = osgeo.ogr.Open('/vsimem//temp1'+ext)
         lyr = ds.GetLayer(0)
+        batch=[]
         feat = lyr.GetNextFeature()
         while feat is not None:
-            geometry+=[feat.Clone()]
-            feat.Destroy()
+            batch+=[feat]
+            if len(batch)>=batchSize:
+                yield batch
+                batch=[]
             feat = lyr.GetNextFeature()
+        if len(batch)>0:
+            yield batch
+    finally:
         ds.Destroy()
-        osgeo.gdal.Unlink('/vsimem//temp1'+ext)
-        return geometry
-    except Exception,e:
-        print >> sys.stderr,e
-        return []
+
+def readFileFromBuffer(data,ext,batchSize):
+    path='/vsimem//temp'+str(id(data))+ext
+    print(path,file=sys.stderr)
+    osgeo.gdal.FileFromMemBuffer(path,data)
+    try:
+        for batch in readLayer(path,batchSize):
+            yield batch
+    except Exception as e:
+        print(e,file=sys.stderr)
+    finally:
+        osgeo.gdal.Unlink(path)
     
 def buildFeatureFromGeomtry(conf,geom,driverName,ext):
     drv = osgeo.ogr.GetDriverByName( driverName )
@@ -66,341 +87,1057 @@ def buildFeatureFromGeomtry(conf,geom,driverName,ext):
     ds.Destroy()
     return [feat]
 
-def createGeometryFromWFS(conf,my_wfs_response):
+def createGeometryFromWFS(conf,my_wfs_response,batchSize):
     try:
         geom=osgeo.ogr.CreateGeometryFromGML(my_wfs_response.replace('<?xml version="1.0" encoding="utf-8"?>\n','').replace('<?xml version=\'1.0\' encoding="utf-8"?>\n',''))
-    except Exception,e:
-        print >> sys.stderr,"**"
-        print >> sys.stderr,e
+    except Exception as e:
+        print("**",file=sys.stderr)
+        print(e,file=sys.stderr)
         geom=None
-    try:
-        print >> sys.stderr,geom is None
-        if geom is None:
-            if not(conf["lenv"].has_key("cnt")):
-                conf["lenv"]["cnt"]=0
-            else:
-                conf["lenv"]["cnt"]+=1
-            return readFileFromBuffer(my_wfs_response,str(conf["lenv"]["cnt"]))
-        else:
-            return buildFeatureFromGeomtry(conf,geom,"GML","xml")
-    except:
-        print >> sys.stderr,"Unable to load file input data !!!\n\n\n"
+    if geom is None:
+        return readFileFromBuffer(my_wfs_response,".xml",batchSize)
+    return iter([buildFeatureFromGeomtry(conf,geom,"GML","xml")])
 
-def createLayerFromJson(conf,obj):
+def createLayerFromJson(conf,obj,batchSize):
     geom=osgeo.ogr.CreateGeometryFromJson(obj)
     if geom is None:
-        return readFileFromBuffer(obj,".json")
+        return readFileFromBuffer(obj,".json",batchSize)
     else:
-        return buildFeatureFromGeomtry(conf,geom,"GeoJSON","json")
+        return iter([buildFeatureFromGeomtry(conf,geom,"GeoJSON","json")])
 
-def extractInputs(conf,obj):
-    if obj.keys().count("cache_file"):
-        print >> sys.stderr,obj
-        geometry=[]
-        ds = osgeo.ogr.Open(obj["cache_file"])
-        lyr = ds.GetLayer(0)
-        feat = lyr.GetNextFeature()
-        while feat is not None:
-            geometry+=[feat.Clone()]
-            feat.Destroy()
-            feat = lyr.GetNextFeature()
-        ds.Destroy()
-        return geometry    
+def getBatchSize(conf):
+    """
+    Return the number of features read and written at once, from the
+    batchSize AdditionalParameters of the service (10000 by default).
+    """
+    try:
+        return max(1,int(getServiceParameter(conf,"batchSize","10000")))
+    except ValueError:
+        return 10000
+
+def getInputCacheKey(conf,obj):
+    """
+    Return the key of the parsed layer of an input in the cache: the name
+    of the .zca file stored by the kernel for the inputs passed by
+    reference, which is the md5 of their request. Return None for the
+    others, the inline values being only used by the current request.
+    """
+    cacheDir=conf["main"]["cacheDir"]
+    if "cache_file" in obj \
+            and os.path.dirname(os.path.abspath(obj["cache_file"]))==os.path.abspath(cacheDir) \
+            and obj["cache_file"].endswith(".zca"):
+        return os.path.basename(obj["cache_file"])[:-4]
+    return None
+
+# Age in seconds after which a copy still being written to the cacheDir is
+# considered left by a failed execution
+CACHE_WRITE_TIMEOUT=3600
+
+def cleanInputCache(cacheDir):
+    """
+    Remove the FlatGeobuf copies of the cacheDir whose .zca file is gone,
+    and the partial ones left by failed executions.
+    """
+    now=time.time()
+    try:
+        names=os.listdir(cacheDir)
+    except OSError:
+        return
+    for name in names:
+        if not(name.endswith(".fgb")):
+            continue
+        path=os.path.join(cacheDir,name)
+        try:
+            if "_" in name:
+                if now-os.path.getmtime(path)>CACHE_WRITE_TIMEOUT:
+                    os.unlink(path)
+            elif not(os.path.exists(path[:-4]+".zca")):
+                os.unlink(path)
+        except OSError:
+            # Renamed or removed by a concurrent execution
+            pass
+
+def getInputCachePath(conf,obj):
+    """
+    Return the path of the FlatGeobuf copy of the parsed input stored in
+    the cacheDir, next to its .zca file, and whether it is up to date.
+    Return None, False if the input is not passed by reference or if the
+    input cache is disabled, by the cacheInputs AdditionalParameters of the
+    service or by the lack of cacheDir.
+    """
+    if not("cacheDir" in conf["main"]) or getServiceParameter(conf,"cacheInputs","true")=="false":
+        return None, False
+    key=getInputCacheKey(conf,obj)
+    if key is None:
+        return None, False
+    path=os.path.join(conf["main"]["cacheDir"],key+".fgb")
+    return path, os.path.exists(path) and os.path.getmtime(path)>=os.path.getmtime(obj["cache_file"])
+
+def cacheFeatures(conf,obj,path,batchSize):
+    """
+    Yield the batches of features parsed from the input while writing them
+    to its copy at path, which is only stored once all of them were read.
+    The batches are still yielded if the copy can't be written.
+    """
+    cleanInputCache(conf["main"]["cacheDir"])
+    # Written under a name of its own then renamed, for concurrent executions
+    tmpPath=path[:-4]+"_"+conf["lenv"]["usid"]+".fgb"
+    ds=None
+    lyr=None
+    try:
+        ds = osgeo.ogr.GetDriverByName("FlatGeobuf").CreateDataSource(tmpPath)
+    except Exception as e:
+        print("Unable to cache the input: "+str(e),file=sys.stderr)
+    try:
+        for batch in parseFeatures(conf,obj,batchSize):
+            if ds is not None:
+                try:
+                    for feature in batch:
+                        if lyr is None:
+                            geom=feature.GetGeometryRef()
+                            lyr = ds.CreateLayer( "Input", geom.GetSpatialReference() if geom is not None else None,
+                                                  osgeo.ogr.wkbUnknown, options = ['SPATIAL_INDEX=NO'] )
+                            createFields(lyr,feature)
+                        lyr.CreateFeature(feature)
+                except Exception as e:
+                    print("Unable to cache the input: "+str(e),file=sys.stderr)
+                    ds.Destroy()
+                    ds=None
+            yield batch
+        if ds is not None:
+            if lyr is None:
+                ds.CreateLayer( "Input", None, osgeo.ogr.wkbUnknown, options = ['SPATIAL_INDEX=NO'] )
+            ds.Destroy()
+            ds=None
+            try:
+                os.rename(tmpPath,path)
+            except OSError as e:
+                print("Unable to cache the input: "+str(e),file=sys.stderr)
+    finally:
+        # Not fully read or not written
+        if ds is not None:
+            ds.Destroy()
+        if os.path.exists(tmpPath):
+            os.unlink(tmpPath)
+
+def getInputCache(conf,obj,batchSize):
+    """
+    Return the path of the FlatGeobuf copy of the parsed input stored in
+    the cacheDir, creating it if missing or older than the .zca file.
+    Return None if there is no such copy (see getInputCachePath) or if it
+    can't be created.
+    """
+    path, upToDate = getInputCachePath(conf,obj)
+    if path is None or upToDate:
+        return path
+    for batch in cacheFeatures(conf,obj,path,batchSize):
+        for feature in batch:
+            feature.Destroy()
+    if not(os.path.exists(path)):
+        return None
+    return path
+
+def readFeatures(conf,obj,batchSize=None):
+    """
+    Return an iterator over the features of an input, in lists of at most
+    batchSize features, so that only one batch is held in memory at a time.
+    The input is read from its parsed copy in the cache when available, or
+    the copy is written while the input is parsed.
+    """
+    if batchSize is None:
+        batchSize=getBatchSize(conf)
+    path, upToDate = getInputCachePath(conf,obj)
+    if upToDate:
+        return readLayer(path,batchSize)
+    if path is not None:
+        return cacheFeatures(conf,obj,path,batchSize)
+    return parseFeatures(conf,obj,batchSize)
+
+def parseFeatures(conf,obj,batchSize):
+    if "cache_file" in obj:
+        return readLayer(obj["cache_file"],batchSize)
     if obj["mimeType"]=="application/json":
-        return createLayerFromJson(conf,obj["value"])
+        return createLayerFromJson(conf,obj["value"],batchSize)
     else:
-        return createGeometryFromWFS(conf,obj["value"])
-    
-def outputResult(conf,obj,geom):
+        return createGeometryFromWFS(conf,obj["value"],batchSize)
+
+def getArrow():
+    """
+    Return the pyarrow module if both pyarrow and the Arrow support of the
+    GDAL bindings (3.8 or later) are available, None otherwise.
+    """
+    if not(hasattr(osgeo.ogr.Layer,"WritePyArrow")):
+        return None
+    try:
+        import pyarrow
+    except ImportError:
+        return None
+    return pyarrow
+
+def getGeometryColumn(schema):
+    """
+    Return the index of the WKB geometry column of an Arrow schema.
+    """
+    for i in range(len(schema)):
+        metadata=schema.field(i).metadata
+        if metadata is not None and metadata.get(b"ARROW:extension:name")==b"ogc.wkb":
+            return i
+    return schema.get_field_index("wkb_geometry")
+
+def readArrowLayer(path,batchSize):
+    """
+    Yield the features of the first layer of the datasource at path as
+    pyarrow record batches of at most batchSize rows.
+    """
+    ds = osgeo.ogr.Open(path)
+    if ds is None:
+        print("Unable to open "+path,file=sys.stderr)
+        return
+    stream=None
+    try:
+        lyr = ds.GetLayer(0)
+        stream=lyr.GetArrowStreamAsPyArrow(options=["INCLUDE_FID=NO",
+                                                    "GEOMETRY_ENCODING=WKB",
+                                                    "MAX_FEATURES_IN_BATCH="+str(batchSize)])
+        for batch in stream:
+            yield batch
+    finally:
+        # The stream must be released before its layer
+        stream=None
+        ds.Destroy()
+
+def readColumns(conf,obj,batchSize=None):
+    """
+    Return an iterator over the features of an input as pyarrow record
+    batches with WKB geometries, or None if the columnar path is not
+    available. Only the inputs passed by reference (cache_file) or having
+    a parsed copy in the cache are read this way, the other values given
+    in the request are small enough. The layers without geometry are left
+    to the features path too.
+    """
+    if getArrow() is None:
+        return None
+    if batchSize is None:
+        batchSize=getBatchSize(conf)
+    path=getInputCache(conf,obj,batchSize)
+    if path is None and "cache_file" in obj:
+        path=obj["cache_file"]
+    if path is None:
+        return None
+    batches=readArrowLayer(path,batchSize)
+    first=next(batches,None)
+    if first is None:
+        return iter([])
+    if getGeometryColumn(first.schema)<0:
+        batches.close()
+        return None
+    return itertools.chain([first],batches)
+
+def extractInputs(conf,obj):
+    geometry=[]
+    for batch in readFeatures(conf,obj):
+        geometry+=batch
+    return geometry
+
+def getOutputFormat(obj):
+    """
+    Return the OGR driver name, the file extension, the dataset and the
+    layer creation options to use for an output, from its mimeType and
+    schema.
+    """
+    driverName = "GML"
+    extension = ".xml"
+    opts = ['FORMAT=GML3.2','GML3_LONGSRS=YES']
+    layerOpts = []
     if obj["mimeType"].count("text/xml")>0:
-        driverName = "GML"
-        extension = [ ".xml" , ".xsd" ]
         format_list = { "2.": 'GML2', "3.1.1": 'GML3', "3.1": 'GML3Deegree', "3.2": 'GML3.2' }
-        opts=['FORMAT=%s,GML3_LONGSRS=YES',format_list["3.2"]]
         for i in format_list:
             if obj["mimeType"].count(i)>0:
-                opts=['FORMAT=%s,GML3_LONGSRS=YES',format_list[i]]
+                opts=['FORMAT='+format_list[i],'GML3_LONGSRS=YES']
     if obj["mimeType"]=="application/json":
         driverName = "GeoJSON"
-        extension = [ ".js" ]
-        opts=None
-    if obj.keys().count("schema")>0 and \
+        extension = ".json"
+        opts=[]
+    if obj["mimeType"]=="application/flatgeobuf":
+        driverName = "FlatGeobuf"
+        extension = ".fgb"
+        opts=[]
+        # Packed Hilbert R-tree, for the clients reading ranges of the file
+        layerOpts=['SPATIAL_INDEX=YES']
+    if obj["mimeType"]=="application/vnd.apache.parquet":
+        driverName = "Parquet"
+        extension = ".parquet"
+        opts=[]
+        layerOpts=['GEOMETRY_ENCODING=WKB','COMPRESSION=SNAPPY','WRITE_COVERING_BBOX=YES']
+    if "schema" in obj and \
             obj["schema"]=="http://schemas.opengis.net/kml/2.2.0/ogckml22.xsd":
         driverName = "KML"
-        extension = [ ".kml" ]
-        opts=None
-    drv = osgeo.ogr.GetDriverByName( driverName )
-    print >> sys.stderr,drv
-    # Create virtual file
-    ds = drv.CreateDataSource( "/vsimem/store"+conf["lenv"]["sid"]+extension[0],options = opts)
-    print >> sys.stderr,ds
-    lyr = ds.CreateLayer( "Result", None, osgeo.ogr.wkbUnknown )
-    print >> sys.stderr,lyr
-    i=0
-    print >> sys.stderr,driverName
-    print >> sys.stderr,extension
-    while i < len(geom):
-        if i==0 and driverName!="GeoJSON":
-            poDstFDefn=geom[i].GetDefnRef()
-            if poDstFDefn is not None:
-                nDstFieldCount = poDstFDefn.GetFieldCount()
-                for iField in range(nDstFieldCount):
-                    poSrcFieldDefn = poDstFDefn.GetFieldDefn(iField)
-                    oFieldDefn = osgeo.ogr.FieldDefn(poSrcFieldDefn.GetNameRef(),poSrcFieldDefn.GetType())
-                    oFieldDefn.SetWidth( poSrcFieldDefn.GetWidth() )
-                    oFieldDefn.SetPrecision( poSrcFieldDefn.GetPrecision() )
-                    lyr.CreateField( oFieldDefn )
+        extension = ".kml"
+        opts=[]
+    return driverName, extension, opts, layerOpts
+
+def getFieldDefns(features):
+    """
+    Return copies of the field definitions of the features, which share
+    the same definition, or an empty list if there is no feature.
+    """
+    fields=[]
+    if len(features)>0 and features[0].GetDefnRef() is not None:
+        poDstFDefn=features[0].GetDefnRef()
+        for iField in range(poDstFDefn.GetFieldCount()):
+            poSrcFieldDefn = poDstFDefn.GetFieldDefn(iField)
+            oFieldDefn = osgeo.ogr.FieldDefn(poSrcFieldDefn.GetNameRef(),poSrcFieldDefn.GetType())
+            oFieldDefn.SetWidth( poSrcFieldDefn.GetWidth() )
+            oFieldDefn.SetPrecision( poSrcFieldDefn.GetPrecision() )
+            fields+=[oFieldDefn]
+    return fields
+
+def createFieldDefns(lyr,fields):
+    """
+    Create the fields in lyr, a name used more than once keeping its first
+    definition.
+    """
+    names=set()
+    for oFieldDefn in fields:
+        if oFieldDefn.GetNameRef() not in names:
+            names.add(oFieldDefn.GetNameRef())
+            lyr.CreateField( oFieldDefn )
+
+def createFields(lyr,feature):
+    createFieldDefns(lyr,getFieldDefns([feature]))
+
+class ResultWriter:
+    """
+    Write the features of a result, batch after batch, to a file in tmpPath
+    which is returned to the kernel as the generated_file of the output.
+    When the result mixes the features of two inputs, fields lists the
+    field definitions of both: the layer gets them all and the features are
+    written to it by field name.
+    """
+    def __init__(self,conf,obj,fields=None):
+        self.obj=obj
+        self.fields=fields
+        self.driverName, extension, opts, layerOpts = getOutputFormat(obj)
+        self.path=os.path.join(conf["main"]["tmpPath"],"ZOO_DATA_"+conf["lenv"]["Identifier"]+"_"+conf["lenv"]["usid"]+extension)
+        drv = osgeo.ogr.GetDriverByName( self.driverName )
+        self.ds = drv.CreateDataSource( self.path, options = opts )
+        self.lyr = self.ds.CreateLayer( "Result", None, osgeo.ogr.wkbUnknown, options = layerOpts )
+        self.count=0
+
+    def write(self,features):
+        for feature in features:
+            if self.count==0 and self.fields is not None:
+                createFieldDefns(self.lyr,self.fields)
+            elif self.count==0 and self.driverName!="GeoJSON":
+                createFields(self.lyr,feature)
+            if self.fields is not None:
+                tmp=osgeo.ogr.Feature(self.lyr.GetLayerDefn())
+                tmp.SetFrom(feature)
+                tmp.SetFID(feature.GetFID())
+                feature.Destroy()
+                feature=tmp
+            try:
+                self.lyr.CreateFeature(feature)
+            except RuntimeError as e:
+                print(e,file=sys.stderr)
+            feature.Destroy()
+            self.count+=1
+
+    def writeColumns(self,batch):
+        """
+        Write a pyarrow record batch, with a WKB geometry column or only
+        attributes.
+        """
+        if self.count==0:
+            geometryColumn=getGeometryColumn(batch.schema)
+            for i in range(len(batch.schema)):
+                if i!=geometryColumn:
+                    self.lyr.CreateFieldFromPyArrowSchema(batch.schema.field(i))
+            self.options=[]
+            if geometryColumn>=0:
+                self.options=["GEOMETRY_NAME="+batch.schema.field(geometryColumn).name]
+        self.lyr.WritePyArrow(batch,options=self.options)
+        self.count+=batch.num_rows
+
+    def close(self):
+        self.ds.Destroy()
+        self.obj["generated_file"]=self.path
+
+def outputBatches(conf,obj,batches,fields=None):
+    writer=ResultWriter(conf,obj,fields)
+    for batch in batches:
+        writer.write(batch)
+    writer.close()
+
+def outputResult(conf,obj,geom):
+    outputBatches(conf,obj,[geom])
+
+def streamFeatures(conf,inputObj,outputObj,function,columnFunction=None):
+    """
+    Read the features of inputObj by batches, apply function to each batch
+    and write the features it returns to outputObj. When given and the
+    columnar path is available (see readColumns), columnFunction is applied
+    to the pyarrow record batches of the input instead.
+    """
+    batches=None
+    if columnFunction is not None:
+        batches=readColumns(conf,inputObj)
+    if batches is None:
+        outputBatches(conf,outputObj,(function(batch) for batch in readFeatures(conf,inputObj)))
+        return
+    writer=ResultWriter(conf,outputObj)
+    for batch in batches:
+        writer.writeColumns(columnFunction(batch))
+    writer.close()
+
+# AdditionalParameters of the services, read from their zcfg
+serviceParameters={}
+
+def getServiceParameter(conf,key,default=None):
+    """
+    Return the value of key from the AdditionalParameters of the service
+    zcfg, or default.
+    """
+    identifier=conf["lenv"]["Identifier"]
+    if identifier not in serviceParameters:
+        parameters={}
+        inside=False
         try:
-            lyr.CreateFeature(geom[i])
-        except:
+            for line in open(os.path.join(os.path.dirname(os.path.abspath(__file__)),identifier+".zcfg")):
+                line=line.strip()
+                if line.startswith("<DataInputs>"):
+                    break
+                if line.startswith("<AdditionalParameters>"):
+                    inside=True
+                elif line.startswith("</AdditionalParameters>"):
+                    inside=False
+                elif inside and line.count("=")>0:
+                    tmp=line.split("=",1)
+                    parameters[tmp[0].strip()]=tmp[1].strip()
+        except IOError:
             pass
-        geom[i].Destroy()
-        i+=1
-    ds.Destroy()
-    vsiFile=osgeo.gdal.VSIFOpenL("/vsimem/store"+conf["lenv"]["sid"]+extension[0],"r")
-    i=0
-    while osgeo.gdal.VSIFSeekL(vsiFile,0,os.SEEK_END)>0:
-        i+=1
-    fileSize=osgeo.gdal.VSIFTellL(vsiFile)
-    osgeo.gdal.VSIFSeekL(vsiFile,0,os.SEEK_SET)
-    obj["value"]=osgeo.gdal.VSIFReadL(fileSize,1,vsiFile)
-    osgeo.gdal.Unlink("/vsimem/store"+conf["lenv"]["sid"]+extension[0])
+        serviceParameters[identifier]=parameters
+    return serviceParameters[identifier].get(key,default)
+
+def getWorkers(conf):
+    """
+    Return the number of threads to use for the per-feature operations, from
+    the workers AdditionalParameters of the service (1 by default).
+    """
+    try:
+        return max(1,int(getServiceParameter(conf,"workers","1")))
+    except ValueError:
+        return 1
+
+# Thread pools by number of workers, kept for the life of the process so
+# the caches of their threads (see getCachedTransformation and
+# preparedAreas) are reused from one call to the next
+executors={}
+executorsLock=threading.Lock()
+
+def getExecutor(workers):
+    with executorsLock:
+        if workers not in executors:
+            executors[workers]=ThreadPoolExecutor(workers)
+        return executors[workers]
+
+def parallelMap(function,items,workers=1):
+    """
+    Apply function to consecutive chunks of items in workers threads and
+    return the concatenation of its results, in the order of items. GEOS
+    operations release the GIL, so the chunks run on several cores.
+    """
+    if workers<=1 or len(items)<2:
+        return list(function(items))
+    size=max(1,-(-len(items)//(workers*4)))
+    chunks=[items[i:i+size] for i in range(0,len(items),size)]
+    results=list(getExecutor(workers).map(function,chunks))
+    ret=[]
+    for result in results:
+        ret+=list(result)
+    return ret
+
+def getShapely():
+    """
+    Return the shapely module if Shapely 2 (vectorized operations) is
+    available, None otherwise.
+    """
+    try:
+        import shapely
+    except ImportError:
+        return None
+    if int(shapely.__version__.split(".")[0])<2:
+        return None
+    return shapely
+
+def exportWkb(features):
+    wkbs=[]
+    for feature in features:
+        geom=feature.GetGeometryRef()
+        wkbs+=[geom.ExportToWkb() if geom is not None else None]
+    return wkbs
+
+def applyGeometryOperation(features,operation,fallback,workers=1):
+    """
+    Replace the geometry of each feature by the result of operation, applied
+    with Shapely 2 to arrays of geometries, or by the one of fallback, applied
+    to each OGR geometry when Shapely 2 is missing or gives no result.
+    Features without geometry are left untouched. Both run in chunks on
+    workers threads.
+    """
+    shapely=getShapely()
+    results=[None]*len(features)
+    if shapely is not None:
+        results=parallelMap(lambda chunk: shapely.to_wkb(operation(shapely,shapely.from_wkb(chunk))).tolist(),
+                            exportWkb(features),workers)
+    missing=[]
+    for i in range(len(features)):
+        if results[i] is not None:
+            features[i].SetGeometryDirectly(osgeo.ogr.CreateGeometryFromWkb(results[i]))
+        elif features[i].GetGeometryRef() is not None:
+            missing+=[i]
+    geometries=parallelMap(lambda chunk: [fallback(features[i].GetGeometryRef()) for i in chunk],missing,workers)
+    for k in range(len(missing)):
+        features[missing[k]].SetGeometryDirectly(geometries[k])
+    return features
+
+def applyColumnOperation(batch,operation,fallback,workers=1):
+    """
+    Return the pyarrow record batch with its WKB geometries replaced by the
+    result of operation, applied with Shapely 2, or by the one of fallback,
+    applied to the OGR geometries missing a result or to all of them when
+    operation is None.
+    """
+    pyarrow=getArrow()
+    shapely=getShapely()
+    i=getGeometryColumn(batch.schema)
+    wkbs=batch.column(i).to_pylist()
+    results=[None]*len(wkbs)
+    if shapely is not None and operation is not None:
+        results=parallelMap(lambda chunk: shapely.to_wkb(operation(shapely,shapely.from_wkb(chunk))).tolist(),
+                            wkbs,workers)
+    missing=[k for k in range(len(wkbs)) if results[k] is None and wkbs[k] is not None]
+
+    def fallbackChunk(chunk):
+        geometries=[fallback(osgeo.ogr.CreateGeometryFromWkb(wkbs[k])) for k in chunk]
+        return [bytes(g.ExportToWkb()) if g is not None else None for g in geometries]
+
+    geometries=parallelMap(fallbackChunk,missing,workers)
+    for k in range(len(missing)):
+        results[missing[k]]=geometries[k]
+    return replaceGeometryColumn(batch,i,results)
+
+def replaceGeometryColumn(batch,i,wkbs):
+    """
+    Return the pyarrow record batch with the WKB geometries of its column i
+    replaced by wkbs.
+    """
+    pyarrow=getArrow()
+    field=batch.schema.field(i)
+    column=pyarrow.array(wkbs,type=getattr(field.type,"storage_type",field.type))
+    if hasattr(field.type,"wrap_array"):
+        column=field.type.wrap_array(column)
+    columns=[batch.column(j) for j in range(batch.num_columns)]
+    columns[i]=column
+    return pyarrow.RecordBatch.from_arrays(columns,schema=batch.schema)
+
+def centroid(shapely,geometries):
+    import numpy
+    # Non polygon geometries use the centroid of their convex hull
+    polygons=shapely.get_type_id(geometries)==3
+    return shapely.centroid(numpy.where(polygons,geometries,shapely.convex_hull(geometries)))
+
+def ogrCentroid(geom):
+    if geom.GetGeometryType()!=3:
+        geom=geom.ConvexHull()
+    return geom.Centroid()
 
 def BufferPy(conf,inputs,outputs):
-    print >> sys.stderr, "Starting service ..."
+    print("Starting service ...",file=sys.stderr)
     try:
         bdist=float(inputs["BufferDistance"]["value"])
-    except:
+    except (KeyError,ValueError):
         bdist=1
-    print >> sys.stderr, bdist
-    geometry=extractInputs(conf,inputs["InputPolygon"])
-    i=0
-    rgeometries=[]
-    while i < len(geometry):
-        tmp=geometry[i].Clone()
-        resg=geometry[i].GetGeometryRef().Buffer(bdist)
-        tmp.SetGeometryDirectly(resg)
-        rgeometries+=[tmp]
-        geometry[i].Destroy()
-        resg.thisown=False 
-        tmp.thisown=False
-        i+=1
-    outputResult(conf,outputs["Result"],rgeometries)
-    i=0
+    print(bdist,file=sys.stderr)
+    workers=getWorkers(conf)
+    # Same number of segments per quadrant as OGR
+    operation=lambda shapely,g: shapely.buffer(g,bdist,quad_segs=30)
+    fallback=lambda g: g.Buffer(bdist)
+    streamFeatures(conf,inputs["InputPolygon"],outputs["Result"],
+                   lambda batch: applyGeometryOperation(batch,operation,fallback,workers),
+                   lambda batch: applyColumnOperation(batch,operation,fallback,workers))
     return zoo.SERVICE_SUCCEEDED
 
-def Clean(conf,inputs,outputs):
-    from shapely.wkb import loads
-    print >> sys.stderr, "Starting service ..."
-    features=extractInputs(conf,inputs["InputData"])
-    i=0
+def validFeatures(features,workers=1):
+    """
+    Return the features of the list having a valid geometry, the others are
+    destroyed.
+    """
+    shapely=getShapely()
+    if shapely is not None:
+        valid=parallelMap(lambda chunk: shapely.is_valid(shapely.from_wkb(chunk)).tolist(),
+                          exportWkb(features),workers)
+    else:
+        from shapely.wkb import loads
+        valid=[]
+        for feature in features:
+            geom=feature.GetGeometryRef()
+            valid+=[geom is not None and loads(geom.ExportToWkb()).is_valid]
     rgeometries=[]
-    while i < len(features):
-        tmp=features[i].Clone()
-        resg=features[i].GetGeometryRef()
-        if resg is not None:
-            geom = loads(resg.ExportToWkb())
-            if geom.is_valid:
-                tmp.SetGeometryDirectly(resg)
-                rgeometries+=[tmp]
-                print >> sys.stderr,"valid !"
-            else:
-                print >> sys.stderr,"invalid !"
-                print >> sys.stderr,geom.wkt[0:50]
-        features[i].Destroy()
-        resg.thisown=False 
-        tmp.thisown=False
-        i+=1
-    outputResult(conf,outputs["Result"],rgeometries)
-    i=0
-    print >> sys.stderr,"Return"
+    for i in range(len(features)):
+        if valid[i]:
+            rgeometries+=[features[i]]
+        else:
+            features[i].Destroy()
+    print(str(len(features)-len(rgeometries))+" invalid geometries removed",file=sys.stderr)
+    return rgeometries
+
+def validColumns(batch,workers=1):
+    """
+    Return the rows of the pyarrow record batch having a valid geometry.
+    """
+    pyarrow=getArrow()
+    shapely=getShapely()
+    wkbs=batch.column(getGeometryColumn(batch.schema)).to_pylist()
+    if shapely is not None:
+        valid=parallelMap(lambda chunk: shapely.is_valid(shapely.from_wkb(chunk)).tolist(),wkbs,workers)
+    else:
+        from shapely.wkb import loads
+        valid=[wkb is not None and loads(wkb).is_valid for wkb in wkbs]
+    print(str(valid.count(False))+" invalid geometries removed",file=sys.stderr)
+    return batch.filter(pyarrow.array(valid,type=pyarrow.bool_()))
+
+def Clean(conf,inputs,outputs):
+    print("Starting service ...",file=sys.stderr)
+    workers=getWorkers(conf)
+    streamFeatures(conf,inputs["InputData"],outputs["Result"],
+                   lambda batch: validFeatures(batch,workers),
+                   lambda batch: validColumns(batch,workers))
+    print("Return",file=sys.stderr)
     return zoo.SERVICE_SUCCEEDED
 
+# Transformations of each thread, neither the OGR nor the pyproj ones can be
+# shared between threads
+transformations=threading.local()
+maxTransformations=16
+
+def getCachedTransformation(name,key,create):
+    """
+    Return the transformation of the name cache of the current thread for
+    key, created by calling create if missing. The least recently used
+    ones are dropped beyond maxTransformations.
+    """
+    cache=getattr(transformations,name,None)
+    if cache is None:
+        cache=OrderedDict()
+        setattr(transformations,name,cache)
+    if key in cache:
+        transformation=cache.pop(key)
+    else:
+        transformation=create()
+    cache[key]=transformation
+    while len(cache)>maxTransformations:
+        cache.popitem(last=False)
+    return transformation
+
+def getTransformation(source,target,axisOrder="authority"):
+    """
+    Return the OGR CoordinateTransformation between the source and target
+    EPSG codes. With the traditional axisOrder, coordinates are always given
+    as x,y (lon,lat), otherwise in the order defined by the authority.
+    """
+    def create():
+        refs=[]
+        for code in [source,target]:
+            ref = osgeo.osr.SpatialReference()
+            ref.ImportFromEPSG(code)
+            if axisOrder=="traditional":
+                ref.SetAxisMappingStrategy(osgeo.osr.OAMS_TRADITIONAL_GIS_ORDER)
+            refs+=[ref]
+        return osgeo.osr.CoordinateTransformation(refs[0],refs[1])
+    return getCachedTransformation("ogr",(source,target,axisOrder),create)
+
+def getTransformer(source,target,axisOrder="authority"):
+    """
+    Return the pyproj Transformer equivalent to getTransformation, or None
+    if pyproj is not available.
+    """
+    try:
+        import pyproj
+    except ImportError:
+        return None
+    return getCachedTransformation("pyproj",(source,target,axisOrder),
+                                   lambda: pyproj.Transformer.from_crs("EPSG:%d" % source,"EPSG:%d" % target,
+                                                                       always_xy=(axisOrder=="traditional")))
+
+def transformArray(shapely,geometries,source,target,axisOrder):
+    """
+    Transform an array of Shapely geometries with a vectorized pyproj
+    Transformer, the geometries with non finite coordinates once
+    transformed are replaced by None.
+    """
+    import numpy
+    transformer=getTransformer(source,target,axisOrder)
+
+    def project(coords):
+        return numpy.column_stack(transformer.transform(*[coords[:,k] for k in range(coords.shape[1])]))
+
+    geometries=numpy.asarray(geometries,dtype=object)
+    result=geometries.copy()
+    hasZ=shapely.has_z(geometries)
+    result[~hasZ]=shapely.transform(geometries[~hasZ],project)
+    result[hasZ]=shapely.transform(geometries[hasZ],project,include_z=True)
+    invalid=~numpy.isfinite(shapely.bounds(result)).all(axis=1) & ~shapely.is_missing(result) & ~shapely.is_empty(result)
+    result[invalid]=None
+    return result
+
 def TransformService(conf,inputs,outputs):
-    from osgeo import osr
-    geometry=extractInputs(conf,inputs["InputData"])
-    sourceRef = osr.SpatialReference()
     tmp=inputs["SourceCRS"]["value"].split(":")
-    sourceRef.ImportFromEPSG(int(tmp[len(tmp)-1]))
-    targetRef = osr.SpatialReference()    
+    source=int(tmp[len(tmp)-1])
     tmp=inputs["TargetCRS"]["value"].split(":")
-    targetRef.ImportFromEPSG(int(tmp[len(tmp)-1]))
-    transform = osr.CoordinateTransformation(sourceRef, targetRef)
-    i=0
-    rgeometries=[]
-    while i < len(geometry):
-        tmp=geometry[i].Clone()
-        resg=geometry[i].GetGeometryRef()
-        resg.Transform(transform)
-        tmp.SetGeometryDirectly(resg.Clone())
-        rgeometries+=[tmp]
-        geometry[i].Destroy()
-        i+=1
-    outputResult(conf,outputs["TransformedData"],rgeometries)
+    target=int(tmp[len(tmp)-1])
+    axisOrder=getServiceParameter(conf,"axisOrder","authority")
+
+    def transformChunk(features):
+        transform = getTransformation(source,target,axisOrder)
+        for feature in features:
+            if feature.GetGeometryRef() is not None:
+                feature.GetGeometryRef().Transform(transform)
+        return features
+
+    def transformGeometry(geom):
+        geom.Transform(getTransformation(source,target,axisOrder))
+        return geom
+
+    workers=getWorkers(conf)
+    operation=None
+    if getTransformer(source,target,axisOrder) is not None:
+        operation=lambda shapely,g: transformArray(shapely,g,source,target,axisOrder)
+    if operation is None or getShapely() is None:
+        function=lambda batch: parallelMap(transformChunk,batch,workers)
+    else:
+        function=lambda batch: applyGeometryOperation(batch,operation,lambda g: transformGeometry(g.Clone()),workers)
+    streamFeatures(conf,inputs["InputData"],outputs["TransformedData"],function,
+                   lambda batch: applyColumnOperation(batch,operation,transformGeometry,workers))
     return zoo.SERVICE_SUCCEEDED
 
 def BoundaryPy(conf,inputs,outputs):
-    geometry=extractInputs(conf,inputs["InputPolygon"])
-    i=0
-    rgeometries=[]
-    while i < len(geometry):
-        tmp=geometry[i].Clone()
-        resg=geometry[i].GetGeometryRef()
-        resg=resg.GetBoundary()
-        tmp.SetGeometryDirectly(resg)
-        rgeometries+=[tmp]
-        geometry[i].Destroy()
-        i+=1
-    outputResult(conf,outputs["Result"],rgeometries)
+    workers=getWorkers(conf)
+    operation=lambda shapely,g: shapely.boundary(g)
+    fallback=lambda g: g.GetBoundary()
+    streamFeatures(conf,inputs["InputPolygon"],outputs["Result"],
+                   lambda batch: applyGeometryOperation(batch,operation,fallback,workers),
+                   lambda batch: applyColumnOperation(batch,operation,fallback,workers))
     return zoo.SERVICE_SUCCEEDED
 
 def CentroidPy(conf,inputs,outputs):
-    geometry=extractInputs(conf,inputs["InputPolygon"])
-    i=0
-    rgeometries=[]
-    while i < len(geometry):
-        tmp=geometry[i].Clone()
-        resg=geometry[i].GetGeometryRef()
-        if resg.GetGeometryType()!=3:
-            resg=resg.ConvexHull()
-        resg=resg.Centroid()
-        tmp.SetGeometryDirectly(resg)
-        rgeometries+=[tmp]
-        geometry[i].Destroy()
-        i+=1
-    outputResult(conf,outputs["Result"],rgeometries)
+    workers=getWorkers(conf)
+    streamFeatures(conf,inputs["InputPolygon"],outputs["Result"],
+                   lambda batch: applyGeometryOperation(batch,centroid,ogrCentroid,workers),
+                   lambda batch: applyColumnOperation(batch,centroid,ogrCentroid,workers))
     return zoo.SERVICE_SUCCEEDED
 
 def ConvexHullPy(conf,inputs,outputs):
-    geometry=extractInputs(conf,inputs["InputPolygon"])
-    i=0
-    rgeometries=[]
-    while i < len(geometry):
-        tmp=geometry[i].Clone()
-        resg=geometry[i].GetGeometryRef().ConvexHull()
-        tmp.SetGeometryDirectly(resg)
-        rgeometries+=[tmp]
-        geometry[i].Destroy()
-        i+=1
-    outputResult(conf,outputs["Result"],rgeometries)
+    workers=getWorkers(conf)
+    operation=lambda shapely,g: shapely.convex_hull(g)
+    fallback=lambda g: g.ConvexHull()
+    streamFeatures(conf,inputs["InputPolygon"],outputs["Result"],
+                   lambda batch: applyGeometryOperation(batch,operation,fallback,workers),
+                   lambda batch: applyColumnOperation(batch,operation,fallback,workers))
     return zoo.SERVICE_SUCCEEDED
 
-
-
 def EnvelopePy(conf,inputs,outputs):
-    print >> sys.stderr, inputs
-    try:
-        bdist=float(inputs["BufferDistance"]["value"])
-    except:
-        bdist=10
-    geometry=extractInputs(conf,inputs["InputPolygon"])
+    print(inputs,file=sys.stderr)
+    # Only the first feature is used
+    geometry=next(readFeatures(conf,inputs["InputPolygon"],1))
     tmp=geometry[0].GetGeometryRef().GetEnvelope()
     outputs["Result"]["value"]=str(tmp[0])+','+str(tmp[2])+','+str(tmp[1])+','+str(tmp[3])+','+'urn:ogc:def:crs:OGC:1.3:CRS84'
-    print >> sys.stderr,outputs["Result"]
-    return 3
+    print(outputs["Result"],file=sys.stderr)
+    return zoo.SERVICE_SUCCEEDED
 
-def UnionPy(conf,inputs,outputs):
-    geometry1=extractInputs(conf,inputs["InputEntity1"])
-    geometry2=extractInputs(conf,inputs["InputEntity2"])
+class EnvelopeIndex:
+    """
+    Spatial index over the envelopes of a list of features, using a Shapely 2
+    STRtree when available and a regular grid otherwise.
+    """
+    def __init__(self,features):
+        self.envelopes=[]
+        for feature in features:
+            geom=feature.GetGeometryRef()
+            if geom is None or geom.IsEmpty():
+                self.envelopes+=[None]
+            else:
+                self.envelopes+=[geom.GetEnvelope()]
+        self.tree=None
+        shapely=getShapely()
+        if shapely is not None:
+            import numpy
+            self.ids=numpy.array([i for i in range(len(self.envelopes)) if self.envelopes[i] is not None],dtype="int64")
+            boxes=numpy.array([self.envelopes[i] for i in self.ids],dtype="float64").reshape(-1,4)
+            self.tree=shapely.STRtree(shapely.box(boxes[:,0],boxes[:,2],boxes[:,1],boxes[:,3]))
+            self.box=shapely.box
+        else:
+            self.buildGrid()
+
+    def buildGrid(self):
+        envelopes=[e for e in self.envelopes if e is not None]
+        self.cells={}
+        if len(envelopes)==0:
+            return
+        self.minx=min([e[0] for e in envelopes])
+        self.miny=min([e[2] for e in envelopes])
+        # About one cell per feature
+        count=max(1,int(len(envelopes)**0.5))
+        self.width=max((max([e[1] for e in envelopes])-self.minx)/count,1e-12)
+        self.height=max((max([e[3] for e in envelopes])-self.miny)/count,1e-12)
+        for i in range(len(self.envelopes)):
+            if self.envelopes[i] is not None:
+                for cell in self.getCells(self.envelopes[i]):
+                    self.cells.setdefault(cell,[]).append(i)
+
+    def getCells(self,envelope):
+        x0=int((envelope[0]-self.minx)//self.width)
+        x1=int((envelope[1]-self.minx)//self.width)
+        y0=int((envelope[2]-self.miny)//self.height)
+        y1=int((envelope[3]-self.miny)//self.height)
+        return [(x,y) for x in range(x0,x1+1) for y in range(y0,y1+1)]
+
+    def query(self,geom):
+        """
+        Return the sorted indexes of the features whose envelope intersects
+        the one of geom.
+        """
+        if geom is None or geom.IsEmpty():
+            return []
+        e=geom.GetEnvelope()
+        if self.tree is not None:
+            return sorted(self.ids[self.tree.query(self.box(e[0],e[2],e[1],e[3]))].tolist())
+        candidates=set()
+        if len(self.cells)>0:
+            for cell in self.getCells(e):
+                if cell in self.cells:
+                    candidates.update(self.cells[cell])
+        return sorted([i for i in candidates
+                       if self.envelopes[i][0]<=e[1] and self.envelopes[i][1]>=e[0]
+                       and self.envelopes[i][2]<=e[3] and self.envelopes[i][3]>=e[2]])
+
+    def queryAll(self,features):
+        """
+        Return the result of query for the geometry of each feature, in a
+        single bulk query when using a STRtree.
+        """
+        if self.tree is None:
+            return [self.query(feature.GetGeometryRef()) for feature in features]
+        import numpy
+        ids=[]
+        boxes=[]
+        for i in range(len(features)):
+            geom=features[i].GetGeometryRef()
+            if geom is not None and not(geom.IsEmpty()):
+                ids+=[i]
+                boxes+=[geom.GetEnvelope()]
+        result=[[] for feature in features]
+        if len(ids)>0:
+            boxes=numpy.array(boxes,dtype="float64").reshape(-1,4)
+            pairs=self.tree.query(self.box(boxes[:,0],boxes[:,2],boxes[:,1],boxes[:,3]))
+            for k in numpy.lexsort((self.ids[pairs[1]],pairs[0])):
+                result[ids[pairs[0][k]]].append(int(self.ids[pairs[1][k]]))
+        return result
+
+def overlay(batches1,geometry2,operation,attributes=2,unmatched=[],skipEmpty=True,unique=False):
+    """
+    Apply operation to the pairs of features from the batches of batches1
+    and from geometry2 whose envelopes intersect, the result takes the
+    attributes of the feature from the attributes side. The features with no
+    such pair on the sides listed in unmatched are kept as they are. With
+    unique, a feature of geometry2 is used in one result at most. Yield the
+    list of resulting features for each batch of batches1, only geometry2
+    is held in memory.
+    """
+    index=EnvelopeIndex(geometry2)
+    matched=set()
+    fids=set()
+    for geometry1 in batches1:
+        yield overlayBatch(geometry1,geometry2,index,operation,attributes,
+                           unmatched,skipEmpty,unique,matched,fids)
+    rgeometries=[]
+    for j in range(len(geometry2)):
+        if 2 in unmatched and j not in matched and geometry2[j].GetGeometryRef() is not None:
+            rgeometries+=[geometry2[j].Clone()]
+        geometry2[j].Destroy()
+    yield rgeometries
+
+def overlayBatch(geometry1,geometry2,index,operation,attributes,unmatched,skipEmpty,unique,matched,fids):
     rgeometries=[]
-    i=0
-    while i < len(geometry1):
-        j=0
-        while j < len(geometry2):
-            tmp=geometry1[i].Clone()
-            resg=geometry2[j].GetGeometryRef()
-            resg=resg.Union(geometry1[i].GetGeometryRef())
+    allCandidates=index.queryAll(geometry1)
+    for i in range(len(geometry1)):
+        geom1=geometry1[i].GetGeometryRef()
+        candidates=allCandidates[i]
+        for j in candidates:
+            if unique and geometry2[j].GetFID() in fids:
+                continue
+            resg=getattr(geom1,operation)(geometry2[j].GetGeometryRef())
+            if resg is None or (skipEmpty and resg.IsEmpty()):
+                continue
+            if attributes==2:
+                tmp=geometry2[j].Clone()
+            else:
+                tmp=geometry1[i].Clone()
             tmp.SetGeometryDirectly(resg)
-            if not(resg.IsEmpty()):
-                rgeometries+=[tmp]
-            j+=1
+            rgeometries+=[tmp]
+            if unique:
+                fids.add(geometry2[j].GetFID())
+        matched.update(candidates)
+        if len(candidates)==0 and 1 in unmatched and geom1 is not None:
+            rgeometries+=[geometry1[i].Clone()]
         geometry1[i].Destroy()
-        i+=1
-    i=0
-    while i < len(geometry2):
-        geometry2[i].Destroy()
-        i+=1
-    outputResult(conf,outputs["Result"],rgeometries)
-    return 3
+    return rgeometries
+
+def readOverlayInputs(conf,inputs):
+    """
+    Return the batches of InputEntity1, the features of InputEntity2 and
+    the field definitions of both, for the overlays whose result mixes the
+    features of the two inputs.
+    """
+    geometry2=extractInputs(conf,inputs["InputEntity2"])
+    batches1=readFeatures(conf,inputs["InputEntity1"])
+    first=next(batches1,[])
+    return itertools.chain([first],batches1), geometry2, getFieldDefns(first)+getFieldDefns(geometry2)
+
+def UnionPy(conf,inputs,outputs):
+    batches1, geometry2, fields = readOverlayInputs(conf,inputs)
+    outputBatches(conf,outputs["Result"],
+                  overlay(batches1,geometry2,"Union",attributes=1,unmatched=[1,2]),fields)
+    return zoo.SERVICE_SUCCEEDED
+
+# Prepared area of each thread, GEOS builds the index of a prepared
+# geometry on its first use
+preparedAreas=threading.local()
+
+def getPreparedArea(shapely,area):
+    if getattr(preparedAreas,"wkb",None)!=area:
+        preparedAreas.area=shapely.from_wkb(area)
+        shapely.prepare(preparedAreas.area)
+        preparedAreas.wkb=area
+    return preparedAreas.area
+
+def getArea(features):
+    """
+    Return the WKB of the union of the geometries of features, which are
+    destroyed, or None if they have no geometry.
+    """
+    wkbs=[bytes(wkb) for wkb in exportWkb(features) if wkb is not None]
+    for feature in features:
+        feature.Destroy()
+    if len(wkbs)<2:
+        return wkbs[0] if len(wkbs)>0 else None
+    shapely=getShapely()
+    if shapely is not None:
+        return shapely.to_wkb(shapely.union_all(shapely.from_wkb(wkbs)))
+    area=osgeo.ogr.CreateGeometryFromWkb(wkbs[0])
+    for wkb in wkbs[1:]:
+        area=area.Union(osgeo.ogr.CreateGeometryFromWkb(wkb))
+    return bytes(area.ExportToWkb())
+
+def clipWkbs(wkbs,area,clip=True,workers=1):
+    """
+    Return, for each WKB geometry, True if it lies inside the area (WKB),
+    None if it doesn't intersect it, otherwise True for a filter or, to
+    clip, the WKB of its intersection with the area. The area is prepared
+    once with Shapely 2 so that only the geometries crossing its boundary
+    get an exact intersection computed.
+    """
+    if area is None:
+        return [None]*len(wkbs)
+    shapely=getShapely()
+    if shapely is not None:
+        import numpy
+
+        def clipChunk(chunk):
+            prepared=getPreparedArea(shapely,area)
+            geometries=shapely.from_wkb(chunk)
+            inside=shapely.contains(prepared,geometries)
+            crossing=shapely.intersects(prepared,geometries) & ~inside
+            result=numpy.full(len(chunk),None,dtype=object)
+            result[inside]=True
+            if clip:
+                clipped=shapely.intersection(geometries[crossing],prepared)
+                clipped[shapely.is_empty(clipped)]=None
+                result[crossing]=shapely.to_wkb(clipped)
+            else:
+                result[crossing]=True
+            return result.tolist()
+    else:
+        ogrArea=osgeo.ogr.CreateGeometryFromWkb(area)
+
+        def clipChunk(chunk):
+            result=[]
+            for wkb in chunk:
+                geom=osgeo.ogr.CreateGeometryFromWkb(wkb) if wkb is not None else None
+                if geom is None or not(ogrArea.Intersects(geom)):
+                    result+=[None]
+                elif not(clip) or ogrArea.Contains(geom):
+                    result+=[True]
+                else:
+                    geom=geom.Intersection(ogrArea)
+                    result+=[bytes(geom.ExportToWkb()) if geom is not None and not(geom.IsEmpty()) else None]
+            return result
+    return parallelMap(clipChunk,wkbs,workers)
+
+def clipFeatures(features,area,clip=True,workers=1):
+    results=clipWkbs(exportWkb(features),area,clip,workers)
+    rgeometries=[]
+    for i in range(len(features)):
+        if results[i] is None:
+            features[i].Destroy()
+            continue
+        if results[i] is not True:
+            features[i].SetGeometryDirectly(osgeo.ogr.CreateGeometryFromWkb(results[i]))
+        rgeometries+=[features[i]]
+    return rgeometries
+
+def clipColumns(batch,area,clip=True,workers=1):
+    pyarrow=getArrow()
+    i=getGeometryColumn(batch.schema)
+    wkbs=batch.column(i).to_pylist()
+    results=clipWkbs(wkbs,area,clip,workers)
+    if clip:
+        batch=replaceGeometryColumn(batch,i,[wkbs[k] if results[k] is True else results[k] for k in range(len(wkbs))])
+    return batch.filter(pyarrow.array([result is not None for result in results],type=pyarrow.bool_()))
 
 def IntersectionPy(conf,inputs,outputs):
 
-    geometry1=extractInputs(conf,inputs["InputEntity1"])
+    mode="intersection"
+    if "Mode" in inputs and inputs["Mode"]["value"] in ["clip","filter"]:
+        mode=inputs["Mode"]["value"]
+    if mode!="intersection":
+        # The second input is the area of interest
+        area=getArea(extractInputs(conf,inputs["InputEntity2"]))
+        workers=getWorkers(conf)
+        streamFeatures(conf,inputs["InputEntity1"],outputs["Result"],
+                       lambda batch: clipFeatures(batch,area,mode=="clip",workers),
+                       lambda batch: clipColumns(batch,area,mode=="clip",workers))
+        return zoo.SERVICE_SUCCEEDED
+
     geometry2=extractInputs(conf,inputs["InputEntity2"])
 
-    print >> sys.stderr,str(len(geometry1))+" "+str(len(geometry2))
+    print(str(len(geometry2)),file=sys.stderr)
 
-    rgeometries=[]
-    fids=[]
-    i=0
-    while i < len(geometry1):
-        j=0
-        while j < len(geometry2):
-            tmp=geometry2[j].Clone()
-            resg=geometry2[j].GetGeometryRef()
-            #resg=resg.Intersection(geometry1[i].GetGeometryRef())
-            resg=geometry1[i].GetGeometryRef().Intersection(resg)
-            tmp.SetGeometryDirectly(resg)
-            if resg is not None and not(resg.IsEmpty()) and fids.count(tmp.GetFID())==0:
-                rgeometries+=[tmp]
-                fids+=[tmp.GetFID()]
-            else:
-                tmp.Destroy()
-            j+=1
-        geometry1[i].Destroy()
-        i+=1
-    i=0
-    while i < len(geometry2):
-        geometry2[i].Destroy()
-        i+=1
-    outputResult(conf,outputs["Result"],rgeometries)
-    print >> sys.stderr,"/outputResult"
-    return 3
+    outputBatches(conf,outputs["Result"],
+                  overlay(readFeatures(conf,inputs["InputEntity1"]),geometry2,"Intersection",unique=True))
+    print("/outputResult",file=sys.stderr)
+    return zoo.SERVICE_SUCCEEDED
 
 def DifferencePy(conf,inputs,outputs):
-    geometry1=extractInputs(conf,inputs["InputEntity1"])
+    # Every feature of the result comes from InputEntity1, with its attributes
     geometry2=extractInputs(conf,inputs["InputEntity2"])
-    rgeometries=[]
-    i=0
-    while i < len(geometry1):
-        j=0
-        while j < len(geometry2):
-            tmp=geometry2[j].Clone()
-            resg=geometry1[i].GetGeometryRef()
-            resg=resg.Difference(geometry2[i].GetGeometryRef())
-            tmp.SetGeometryDirectly(resg)
-            if not(resg.IsEmpty()):
-                rgeometries+=[tmp]
-            j+=1
-        geometry1[i].Destroy()
-        i+=1
-    i=0
-    while i < len(geometry2):
-        geometry2[i].Destroy()
-        i+=1
-    outputResult(conf,outputs["Result"],rgeometries)
-    return 3
+    outputBatches(conf,outputs["Result"],
+                  overlay(readFeatures(conf,inputs["InputEntity1"]),geometry2,"Difference",
+                          attributes=1,unmatched=[1]))
+    return zoo.SERVICE_SUCCEEDED
 
 def SymDifferencePy(conf,inputs,outputs):
-    geometry1=extractInputs(conf,inputs["InputEntity1"])
-    geometry2=extractInputs(conf,inputs["InputEntity2"])
-    rgeometries=[]
-    i=0
-    while i < len(geometry1):
-        j=0
-        while j < len(geometry2):
-            tmp=geometry2[j].Clone()
-            resg=geometry1[i].GetGeometryRef()
-            resg=resg.SymmetricDifference(geometry2[i].GetGeometryRef())
-            tmp.SetGeometryDirectly(resg)
-            rgeometries+=[tmp]
-            j+=1
-        geometry1[i].Destroy()
-        i+=1
-    i=0
-    while i < len(geometry2):
-        geometry2[i].Destroy()
-        i+=1
-    outputResult(conf,outputs["Result"],rgeometries)
-    return 3
-
+    batches1, geometry2, fields = readOverlayInputs(conf,inputs)
+    outputBatches(conf,outputs["Result"],
+                  overlay(batches1,geometry2,"SymmetricDifference",unmatched=[1,2],skipEmpty=False),fields)
+    return zoo.SERVICE_SUCCEEDED
@@ -0,0 +1,143 @@
+#
+# Copyright 2026 GeoLabs SARL. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including with
+# out limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Checks of the attributes of the ogr_sp overlay services, run in-process
+# outside of the ZOO-Kernel on two layers with different schemas.
+#
+# example usage:
+# python -m unittest test_overlay.py
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+from osgeo import ogr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cgi-env"))
+
+try:
+    import zoo
+except ImportError:
+    # The zoo module is provided by the ZOO-Kernel embedding the interpreter
+    zoo = types.ModuleType("zoo")
+    zoo.SERVICE_SUCCEEDED = 3
+    zoo.SERVICE_FAILED = 4
+    zoo._ = lambda message: message
+    sys.modules["zoo"] = zoo
+
+import ogr_sp
+
+
+def square(x, y, size=1.0):
+    return ogr.CreateGeometryFromWkt(
+        "POLYGON ((%f %f, %f %f, %f %f, %f %f, %f %f))"
+        % (x, y, x + size, y, x + size, y + size, x, y + size, x, y))
+
+
+def write_layer(path, fields, rows):
+    """
+    Write a GeoJSON layer with the (name, type) fields and the
+    (values, geometry) rows.
+    """
+    ds = ogr.GetDriverByName("GeoJSON").CreateDataSource(path)
+    lyr = ds.CreateLayer("Input", None, ogr.wkbPolygon)
+    for name, fieldType in fields:
+        lyr.CreateField(ogr.FieldDefn(name, fieldType))
+    for values, geom in rows:
+        feature = ogr.Feature(lyr.GetLayerDefn())
+        for (name, fieldType), value in zip(fields, values):
+            feature.SetField(name, value)
+        feature.SetGeometryDirectly(geom)
+        lyr.CreateFeature(feature)
+    ds = None
+
+
+class OverlayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix="ogr_sp_test_")
+        # The second feature of each layer overlaps no feature of the other
+        self.input1 = os.path.join(self.tmp_path, "input1.json")
+        write_layer(self.input1, [("id", ogr.OFTInteger), ("name", ogr.OFTString)],
+                    [([1, "a"], square(0, 0)), ([2, "b"], square(10, 10))])
+        self.input2 = os.path.join(self.tmp_path, "input2.json")
+        write_layer(self.input2, [("code", ogr.OFTString), ("value", ogr.OFTReal)],
+                    [(["X", 1.5], square(0.5, 0.5)), (["Y", 2.5], square(20, 20))])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def run_service(self, service):
+        conf = {
+            "main": {"tmpPath": self.tmp_path},
+            "lenv": {"usid": service, "sid": "0", "Identifier": service},
+        }
+        inputs = {
+            "InputEntity1": {"cache_file": self.input1, "mimeType": "application/json"},
+            "InputEntity2": {"cache_file": self.input2, "mimeType": "application/json"},
+        }
+        outputs = {"Result": {"mimeType": "application/flatgeobuf"}}
+        self.assertEqual(getattr(ogr_sp, service)(conf, inputs, outputs), zoo.SERVICE_SUCCEEDED)
+        ds = ogr.Open(outputs["Result"]["generated_file"])
+        lyr = ds.GetLayer(0)
+        defn = lyr.GetLayerDefn()
+        names = [defn.GetFieldDefn(i).GetNameRef() for i in range(defn.GetFieldCount())]
+        rows = []
+        for feature in lyr:
+            rows.append(dict((name, feature.GetField(name)) for name in names))
+        ds = None
+        return names, rows
+
+    def assertSchema(self, names):
+        self.assertEqual(names, ["id", "name", "code", "value"])
+
+    def test_union(self):
+        names, rows = self.run_service("UnionPy")
+        self.assertSchema(names)
+        self.assertIn({"id": 1, "name": "a", "code": None, "value": None}, rows)
+        self.assertIn({"id": 2, "name": "b", "code": None, "value": None}, rows)
+        self.assertIn({"id": None, "name": None, "code": "Y", "value": 2.5}, rows)
+        self.assertEqual(len(rows), 3)
+
+    def test_difference(self):
+        names, rows = self.run_service("DifferencePy")
+        # The result only holds the features of the first input
+        self.assertEqual(names, ["id", "name"])
+        self.assertIn({"id": 1, "name": "a"}, rows)
+        self.assertIn({"id": 2, "name": "b"}, rows)
+        self.assertEqual(len(rows), 2)
+
+    def test_symdifference(self):
+        names, rows = self.run_service("SymDifferencePy")
+        self.assertSchema(names)
+        self.assertIn({"id": None, "name": None, "code": "X", "value": 1.5}, rows)
+        self.assertIn({"id": 2, "name": "b", "code": None, "value": None}, rows)
+        self.assertIn({"id": None, "name": None, "code": "Y", "value": 2.5}, rows)
+        self.assertEqual(len(rows), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -33,6 +33,7 @@ import logging
 
 import zoo
 import yaml
+from zcfg_util import ZcfgWriter
 from cookiecutter.main import cookiecutter
 
 
@@ -184,89 +185,80 @@ class Process:
         Writes the configuration file for the Zoo process (.zfcg) to a stream.
         """
         logger.info("Writing zcfg to stream")
+        self.get_zcfg().dump(stream)
 
-        print("[{0}]".format(self.identifier), file=stream)
+    def save_zcfg(self, path):
+        """
+        Atomically replaces the configuration file for the Zoo process (.zcfg).
+        """
+        logger.info(f"Writing zcfg to {path}")
+        self.get_zcfg().save(path)
+
+    def get_zcfg(self):
+        """
+        Builds the configuration file for the Zoo process (.zcfg) in memory.
+        """
+        zcfg = ZcfgWriter()
+        zcfg.line("[{0}]".format(self.identifier))
         if self.title:
-            print("  Title = {0}".format(self.title), file=stream)
+            zcfg.value("Title", self.title, 2)
         if self.description:
-            print("  Abstract = {0}".format(self.description), file=stream)
+            zcfg.value("Abstract", self.description, 2)
         if self.service_provider:
-            print("  serviceType = {0}".format(self.service_type), file=stream)
-            print("  serviceProvider = {0}".format(self.service_provider), file=stream)
+            zcfg.value("serviceType", self.service_type, 2)
+            zcfg.value("serviceProvider", self.service_provider, 2)
         if self.version:
-            print("  processVersion = {0}".format(self.version), file=stream)
-        print(
-            "  storeSupported = {0}".format(
-                "true" if self.store_supported else "false"
-            ),
-            file=stream,
-        )
-        print(
-            "  statusSupported = {0}".format(
-                "true" if self.status_supported else "false"
-            ),
-            file=stream,
-        )
+            zcfg.value("processVersion", self.version, 2)
+        zcfg.value("storeSupported", "true" if self.store_supported else "false", 2)
+        zcfg.value("statusSupported", "true" if self.status_supported else "false", 2)
 
-        print("  <DataInputs>", file=stream)
+        zcfg.line("<DataInputs>", 2)
         for input in self.inputs:
-            print("    [{0}]".format(input.identifier), file=stream)
-            print("      Title = {0}".format(input.title), file=stream)
-            print("      Abstract = {0}".format(input.description), file=stream)
-            print("      minOccurs = {0}".format(input.min_occurs), file=stream)
-            print(
-                "      maxOccurs = {0}".format(
-                    999 if input.max_occurs == 0 else input.max_occurs
-                ),
-                file=stream,
-            )
+            zcfg.line("[{0}]".format(input.identifier), 4)
+            zcfg.value("Title", input.title, 6)
+            zcfg.value("Abstract", input.description, 6)
+            zcfg.value("minOccurs", input.min_occurs, 6)
+            zcfg.value("maxOccurs", 999 if input.max_occurs == 0 else input.max_occurs, 6)
             if input.is_complex:
                 pass
             else:
-                print("      <LiteralData>", file=stream)
-                print("        dataType = {0}".format(input.type), file=stream)
+                zcfg.line("<LiteralData>", 6)
+                zcfg.value("dataType", input.type, 8)
                 if input.possible_values:
-                    print(
-                        "        AllowedValues = {0}".format(
-                            ",".join(input.possible_values)
-                        ),
-                        file=stream,
-                    )
+                    zcfg.value("AllowedValues", ",".join(input.possible_values), 8)
                 if input.default_value:
-                    print("        <Default>", file=stream)
-                    print(
-                        "          value = {0}".format(input.default_value), file=stream
-                    )
-                    print("        </Default>", file=stream)
+                    zcfg.line("<Default>", 8)
+                    zcfg.value("value", input.default_value, 10)
+                    zcfg.line("</Default>", 8)
                 else:
-                    print("        <Default/>", file=stream)
-                print("      </LiteralData>", file=stream)
-        print("  </DataInputs>", file=stream)
+                    zcfg.line("<Default/>", 8)
+                zcfg.line("</LiteralData>", 6)
+        zcfg.line("</DataInputs>", 2)
 
-        print("  <DataOutputs>", file=stream)
+        zcfg.line("<DataOutputs>", 2)
         for output in self.outputs:
-            print("    [{0}]".format(output.identifier), file=stream)
-            print("      Title = {0}".format(output.title), file=stream)
-            print("      Abstract = {0}".format(output.description), file=stream)
+            zcfg.line("[{0}]".format(output.identifier), 4)
+            zcfg.value("Title", output.title, 6)
+            zcfg.value("Abstract", output.description, 6)
             if output.is_complex:
-                print("      <ComplexData>", file=stream)
-                print("        <Default>", file=stream)
-                print(
-                    "          mimeType = {0}".format(
-                        output.file_content_type
-                        if output.file_content_type
-                        else "text/plain"
-                    ),
-                    file=stream,
+                zcfg.line("<ComplexData>", 6)
+                zcfg.line("<Default>", 8)
+                zcfg.value(
+                    "mimeType",
+                    output.file_content_type
+                    if output.file_content_type
+                    else "text/plain",
+                    10,
                 )
-                print("        </Default>", file=stream)
-                print("      </ComplexData>", file=stream)
+                zcfg.line("</Default>", 8)
+                zcfg.line("</ComplexData>", 6)
             else:
-                print("      <LiteralData>", file=stream)
-                print("        dataType = {0}".format(input.type), file=stream)
-                print("        <Default/>", file=stream)
-                print("      </LiteralData>", file=stream)
-        print("  </DataOutputs>", file=stream)
+                zcfg.line("<LiteralData>", 6)
+                zcfg.value("dataType", output.type, 8)
+                zcfg.line("<Default/>", 8)
+                zcfg.line("</LiteralData>", 6)
+        zcfg.line("</DataOutputs>", 2)
+        return zcfg
 
     def run_sql(self, conf):
         """
@@ -1116,8 +1108,7 @@ class DeployService(object):
                 self.zooservices_folder, f"{self.service_configuration.identifier}.zcfg"
             )
             logger.info(f"writting zcfg file: {zcfg_file}")
-            with open(zcfg_file, "w") as file:
-                self.service_configuration.write_zcfg(file)
+            self.service_configuration.save_zcfg(zcfg_file)
 
         if self.is_consumer():
             logger.info(
@@ -0,0 +1,76 @@
+#
+# Copyright 2026 GeoLabs SARL. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including with
+# out limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import tempfile
+
+
+class ZcfgWriter:
+    """
+    Build a zcfg document in memory, to be written in a single operation once
+    complete.
+    """
+
+    def __init__(self, indent=0):
+        self.indent = indent
+        self.lines = []
+
+    def line(self, text, depth=0):
+        self.lines.append(" " * (self.indent + depth) + text + "\n")
+
+    def value(self, key, value, depth=0):
+        self.line("{0} = {1}".format(key, value), depth)
+
+    def getvalue(self):
+        return "".join(self.lines)
+
+    def dump(self, stream):
+        stream.write(self.getvalue())
+
+    def save(self, path):
+        atomic_write(path, self.getvalue())
+
+
+def atomic_write(path, content, validate=None):
+    """
+    Write content to path through a temporary file renamed over the target,
+    so that a concurrent reader gets either the previous or the new file but
+    never a partially written one. When given, validate is called with the
+    temporary file path before the rename, raising from it leaves the target
+    untouched.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix="." + os.path.basename(path) + ".", dir=directory
+    )
+    try:
+        with os.fdopen(fd, "w") as stream:
+            stream.write(content)
+        os.chmod(tmp_path, 0o644)
+        if validate is not None:
+            validate(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
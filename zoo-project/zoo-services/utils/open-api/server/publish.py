@@ -26,31 +26,39 @@
 
 import os
 import sys
+import json
 import redis
-try:
-    data = sys.stdin.read();
-except Exception as e:
-    print(e,file=sys.stderr)
+from urllib import parse
+from publisher import getMessages, isBatch, streamKey, userChannel, userMessage
 
-print('Content-Type: text/html')
+print('Content-Type: application/json')
 print('')
-print('Environment variables')
-for param in os.environ.keys():
-        print ("<b>%20s</b>: %s<br/>" % (param, os.environ[param]))
-
-print(data)
-
-from urllib import parse
 
 try:
-    params=parse.parse_qs(os.environ["QUERY_STRING"])
+    data = sys.stdin.read()
+    params=parse.parse_qs(os.environ["QUERY_STRING"],keep_blank_values=True)
     r=None
     if "ZOO_REDIS_HOST" in os.environ:
         r = redis.Redis(host=os.environ["ZOO_REDIS_HOST"], port=6379, db=0)
     else:
         r = redis.Redis(host='redis', port=6379, db=0)
-    print(params)
-    r.publish(params["jobid"][0],data)
+    # With batch=1, a JSON array of messages published in a single round-trip
+    messages=getMessages(data,isBatch(params))
+    stream=os.environ.get("ZOO_REDIS_STREAM","false")=="true"
+    pipe=r.pipeline(transaction=False)
+    for message in messages:
+        if stream:
+            # Kept for the subscribers connecting once the job started
+            pipe.xadd(streamKey(params["jobid"][0]),{"data": message},maxlen=100,approximate=True)
+        pipe.publish(params["jobid"][0],message)
+        # The ZOO-Kernel appends the user running the job last
+        if "user" in params and params["user"][-1]!="":
+            pipe.publish(userChannel(params["user"][-1]),userMessage(params["jobid"][0],message))
+    if stream:
+        # Seconds the stream is kept after its last message
+        pipe.expire(streamKey(params["jobid"][0]),int(os.environ.get("ZOO_REDIS_STREAM_TTL","86400")))
+    pipe.execute()
+    print(json.dumps({"published": len(messages)}))
 except Exception as e:
-	print(e)
-
+    print(e,file=sys.stderr)
+    print(json.dumps({"message": str(e)}))
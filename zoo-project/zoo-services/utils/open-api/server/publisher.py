@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+#
+# Copyright 2026 GeoLabs SARL. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including with
+# out limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Long-running replacement for publish.py, keeping a pool of connections to
+# Redis rather than opening a new one for every status update.
+#
+# example usage:
+# publisher.py --port 8889 [--stream] [--maxlen 100]
+# then set publisherUrl=http://<host>:8889/?jobid= in oas.cfg
+#
+# The body of a POST request is published on the channel named by the jobid
+# parameter, and on the channel of the user given by the last user parameter,
+# which the ZOO-Kernel appends to the publisherUrl subscriber URLs with the
+# authenticated user running the job, wrapped as {"jobID": ..., "data": ...}.
+# With batch=1, the body is a JSON array whose items are published as
+# separate messages, in a single round-trip to Redis. Without it the body is always a single message, even
+# a JSON array (the final result of a job with io_as_array set).
+#
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import redis.asyncio as redis
+from urllib import parse
+
+
+def getRedis(maxConnections):
+    if "ZOO_REDIS_HOST" in os.environ:
+        host=os.environ["ZOO_REDIS_HOST"]
+    else:
+        host='redis'
+    return redis.Redis(connection_pool=redis.BlockingConnectionPool(host=host, port=6379, db=0,
+                                                                    max_connections=maxConnections))
+
+
+def getMessages(data,batch=False):
+    """
+    Return the list of messages to publish from a request body, a JSON array
+    of messages when batch is set.
+    """
+    if not(batch):
+        return [data]
+    tmp=json.loads(data)
+    if not(isinstance(tmp,list)):
+        raise ValueError("A batch must be a JSON array")
+    return [json.dumps(x) if not(isinstance(x,str)) else x for x in tmp]
+
+
+def isBatch(params):
+    return params.get("batch",["0"])[-1] in ["1","true"]
+
+
+def streamKey(jobID):
+    return "zoo:events:"+jobID
+
+
+def userChannel(user):
+    return "zoo:user:"+user
+
+
+def userMessage(jobID,message):
+    """
+    Wrap a message published on a user channel with the identifier of its
+    job, which the final results and exceptions do not carry.
+    """
+    return json.dumps({"jobID": jobID, "data": message})
+
+
+class Publisher:
+
+    def __init__(self,r,stream=False,maxlen=100,ttl=86400):
+        self.redis=r
+        self.stream=stream
+        self.maxlen=maxlen
+        self.ttl=ttl
+
+    async def publish(self,jobID,messages,user=None):
+        pipe=self.redis.pipeline(transaction=False)
+        for message in messages:
+            if self.stream:
+                # Kept for the subscribers connecting once the job started
+                pipe.xadd(streamKey(jobID),{"data": message},maxlen=self.maxlen,approximate=True)
+            pipe.publish(jobID,message)
+            if user is not None:
+                pipe.publish(userChannel(user),userMessage(jobID,message))
+        if self.stream:
+            pipe.expire(streamKey(jobID),self.ttl)
+        await pipe.execute()
+
+    async def respond(self,writer,status,body,keepAlive):
+        body=body.encode('utf-8')
+        writer.write(("HTTP/1.1 "+status+"\r\n"
+                      "Content-Type: application/json\r\n"
+                      "Content-Length: "+str(len(body))+"\r\n"
+                      "Connection: "+("keep-alive" if keepAlive else "close")+"\r\n\r\n").encode('utf-8')+body)
+        await writer.drain()
+
+    async def handle(self,reader,writer):
+        try:
+            while True:
+                line=await reader.readline()
+                if not line:
+                    break
+                method, target, version = line.decode('latin-1').strip().split(" ",2)
+                headers={}
+                while True:
+                    line=(await reader.readline()).decode('latin-1').strip()
+                    if not line:
+                        break
+                    key, value = line.split(":",1)
+                    headers[key.strip().lower()]=value.strip()
+                data=await reader.readexactly(int(headers.get("content-length","0")))
+                keepAlive=headers.get("connection","").lower()!="close" and version=="HTTP/1.1"
+                params=parse.parse_qs(parse.urlparse(target).query,keep_blank_values=True)
+                if method!="POST":
+                    await self.respond(writer,"405 Method Not Allowed",'{"message": "Only POST is supported"}',keepAlive)
+                elif "jobid" not in params:
+                    await self.respond(writer,"400 Bad Request",'{"message": "Missing jobid parameter"}',keepAlive)
+                else:
+                    try:
+                        messages=getMessages(data.decode('utf-8'),isBatch(params))
+                    except ValueError as e:
+                        await self.respond(writer,"400 Bad Request",json.dumps({"message": str(e)}),keepAlive)
+                        continue
+                    try:
+                        await self.publish(params["jobid"][0],messages,
+                                           params["user"][-1] or None if "user" in params else None)
+                        await self.respond(writer,"200 OK",json.dumps({"published": len(messages)}),keepAlive)
+                    except redis.RedisError as e:
+                        print(e,file=sys.stderr)
+                        await self.respond(writer,"503 Service Unavailable",json.dumps({"message": str(e)}),keepAlive)
+                if not(keepAlive):
+                    break
+        except (ValueError,asyncio.IncompleteReadError,ConnectionError) as e:
+            print(e,file=sys.stderr)
+        finally:
+            writer.close()
+
+
+async def main(args):
+    publisher=Publisher(getRedis(args.connections),args.stream,args.maxlen,args.ttl)
+    server=await asyncio.start_server(publisher.handle,args.host,args.port)
+    async with server:
+        await server.serve_forever()
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Publish the job status updates to Redis")
+    parser.add_argument("--host",default="0.0.0.0")
+    parser.add_argument("--port",type=int,default=8889)
+    parser.add_argument("--connections",type=int,default=10,help="size of the Redis connection pool")
+    parser.add_argument("--stream",action="store_true",help="also append the messages to a Redis Stream per job")
+    parser.add_argument("--maxlen",type=int,default=100,help="number of messages kept in each stream")
+    parser.add_argument("--ttl",type=int,default=86400,help="seconds a stream is kept after its last message")
+    asyncio.run(main(parser.parse_args()))
@@ -12,64 +12,392 @@
 # example usage:
 # websocketd --port=4430 --ssl --sslcert /ssl/fullchain.pem --sslkey /ssl/privkey.pem subscriber.py --devconsole
 #
+# Commands:
+# SUB <jobid> [<count>]: forward the messages published for the job, starting
+#   with the last <count> ones (ZOO_SUBSCRIBER_REPLAY by default) kept in its
+#   event stream when the publisher writes one (see publisher.py --stream)
+# PSUB <pattern>: forward the messages published for the jobs of the
+#   authenticated user whose identifier matches the glob-style pattern
+# USUB: forward the messages published for all the jobs of the authenticated
+#   user (REMOTE_USER or the header named by ZOO_SUBSCRIBER_USER_HEADER, set
+#   by the reverse proxy)
+# PSUB and USUB rely on the ZOO-Kernel appending the user running the job to
+# the publisherUrl callbacks, so they only get the jobs run with a security
+# service setting the authenticated user.
+# Each command accepts a trailing "progress" or "final" to only get the
+# progress or the final messages. The messages of USUB and PSUB are sent as
+# published on the user channel: {"jobID": <jobid>, "data": <message>}.
+#
+# The progress messages of a job are sent at most once per
+# ZOO_SUBSCRIBER_COALESCE seconds, only the latest one being kept meanwhile,
+# final messages are always sent. At most ZOO_SUBSCRIBER_BUFFER messages wait
+# for a slow client, older progress messages get dropped first.
+#
 
-from sys import stdout, stdin
 import sys
-import threading
-import redis
+import asyncio
+import collections
+import fnmatch
+import redis.asyncio as redis
 import json
 import os
 
-mThreads=[]
-r=None
-
-if "ZOO_REDIS_HOST" in os.environ:
-    r = redis.Redis(host=os.environ["ZOO_REDIS_HOST"], port=6379, db=0)
-else:
-    r = redis.Redis(host='redis', port=6379, db=0)
-
-def send(t):
-    # send string to web page
-    stdout.write(t+'\n')
-    stdout.flush()
-
-def listenMessages(jobID=None):
-    global r
-    p = r.pubsub()
-    p.subscribe(jobID)
-    hasSend=False
-    for raw_message in p.listen():
-        try:
-            send(str(raw_message["data"],'utf-8'))
-            hasSend=True
-            try:
-                tmp=json.loads(str(raw_message["data"],'utf-8'))
-                if tmp is not None and "outputs" in tmp:
-                    sys.exit()
-            except Exception as e:
-                print(str(e))
+# Number of past events replayed on subscription
+REPLAY=int(os.environ.get("ZOO_SUBSCRIBER_REPLAY","20"))
+# Coalescing window of the progress messages, in seconds
+COALESCE=float(os.environ.get("ZOO_SUBSCRIBER_COALESCE","0.25"))
+# Number of messages waiting to be written
+BUFFER=int(os.environ.get("ZOO_SUBSCRIBER_BUFFER","256"))
+
+
+def getRedis():
+    if "ZOO_REDIS_HOST" in os.environ:
+        return redis.Redis(host=os.environ["ZOO_REDIS_HOST"], port=6379, db=0)
+    return redis.Redis(host='redis', port=6379, db=0)
+
+
+def decode(data):
+    try:
+        return str(data,'utf-8')
+    except Exception:
+        return str(data)
+
+
+def streamKey(jobID):
+    return "zoo:events:"+jobID
+
+
+def userChannel(user):
+    return "zoo:user:"+user
+
+
+def getUser():
+    """
+    Return the authenticated user of the websocket, if any.
+    """
+    if "ZOO_SUBSCRIBER_USER_HEADER" in os.environ:
+        header="HTTP_"+os.environ["ZOO_SUBSCRIBER_USER_HEADER"].upper().replace("-","_")
+        if header in os.environ:
+            return os.environ[header]
+    return os.environ.get("REMOTE_USER")
+
+
+def parseOptions(args):
+    """
+    Return the replay count and the event filter from the command arguments.
+    """
+    count=REPLAY
+    eventFilter="all"
+    for arg in args:
+        if arg.isdigit():
+            count=int(arg)
+        elif arg in ["progress","final","all"]:
+            eventFilter=arg
+    return count, eventFilter
+
+
+def accept(eventFilter,final):
+    return eventFilter=="all" or (eventFilter=="final")==final
+
+
+def parseEvent(message):
+    try:
+        tmp=json.loads(message)
+    except ValueError:
+        return None
+    return tmp if isinstance(tmp,dict) else None
+
+
+def isFinal(event):
+    """
+    Tell if the event is the last one published for a job.
+    """
+    return event is not None and ("outputs" in event or event.get("status") in ["failed","dismissed"])
+
+
+class Outbox:
+    """
+    Bounded queue of the messages waiting to be written. A progress message
+    replaces the one of the same job still waiting, when full the oldest
+    progress message is dropped, and the overflow event is set if only final
+    messages are waiting.
+    """
+
+    def __init__(self,maxsize):
+        self.maxsize=maxsize
+        self.items=collections.deque()
+        self.ready=asyncio.Event()
+        self.empty=asyncio.Event()
+        self.empty.set()
+        self.overflow=asyncio.Event()
+
+    def put(self,data,key=None,final=True):
+        if not(final):
+            for i in range(len(self.items)):
+                if self.items[i][0]==key and not(self.items[i][2]):
+                    self.items[i]=(key,data,final)
+                    return
+        if len(self.items)>=self.maxsize:
+            for i in range(len(self.items)):
+                if not(self.items[i][2]):
+                    del self.items[i]
+                    break
+            else:
+                self.overflow.set()
                 return
-        except:
-            if not(hasSend):
-                send(str(raw_message["data"]))
-
-
-def receive():
-    global n
-    global mThreads
-    while True:
-        t = stdin.readline().strip()
-        if not t:
-            break
-        t1 = t.split(" ")
-        if t1[0]=="SUB":
-            mThreads += [threading.Thread(target=listenMessages,kwargs={"jobID":t1[1]})]
-            mThreads[len(mThreads)-1].start()
+        self.items.append((key,data,final))
+        self.empty.clear()
+        self.ready.set()
+
+    async def get(self):
+        while not(self.items):
+            self.ready.clear()
+            await self.ready.wait()
+        return self.items.popleft()[1]
+
+    def done(self):
+        if not(self.items):
+            self.empty.set()
+
+    async def join(self):
+        await self.empty.wait()
+
+
+class Subscriber:
+    """
+    Forward the messages published for the subscribed jobs to websocketd.
+    All the subscriptions share a single pubsub connection and only the
+    write coroutine ever writes to stdout.
+    """
+
+    def __init__(self,r,writer):
+        self.redis=r
+        self.pubsub=r.pubsub()
+        self.writer=writer
+        self.outbox=Outbox(BUFFER)
+        self.loop=asyncio.get_running_loop()
+        # Latest progress of each job waiting for its coalescing window
+        self.pending={}
+        # Time the last progress of each job was queued
+        self.sent={}
+        self.subscribed=asyncio.Event()
+        # Jobs being unsubscribed, their late messages are dropped
+        self.finished=set()
+        # Live messages held while the past events of a job are replayed
+        self.replaying={}
+        # Replayed events which may still come through the subscription
+        self.replayed={}
+        # Event filter of each subscribed channel
+        self.filters={}
+        # Event filter of each pattern matching the jobs of the user channel
+        self.patterns={}
+
+    def send(self,t):
+        # send string to web page
+        self.outbox.put(t)
+
+    def emit(self,key,data,final):
+        """
+        Queue an event of the job key, its progress is queued at most once per
+        coalescing window, final events right away.
+        """
+        if final or COALESCE<=0:
+            self.pending.pop(key,None)
+            self.sent.pop(key,None)
+            self.outbox.put(data,key,final)
+            return
+        if key in self.pending:
+            self.pending[key]=data
+            return
+        now=self.loop.time()
+        wait=self.sent.get(key,now-COALESCE)+COALESCE-now
+        if wait<=0:
+            self.sent[key]=now
+            self.outbox.put(data,key,False)
         else:
-            send(t)
+            self.pending[key]=data
+            self.loop.call_later(wait,self.flush,key)
+
+    def flush(self,key):
+        if key in self.pending:
+            self.sent[key]=self.loop.time()
+            self.outbox.put(self.pending.pop(key),key,False)
+
+    async def write(self):
+        while True:
+            t=await self.outbox.get()
+            self.writer.write((t+'\n').encode('utf-8'))
+            await self.writer.drain()
+            self.outbox.done()
+
+    async def subscribe(self,jobID,replay=REPLAY,eventFilter="all"):
+        # The user channels and streams are only reachable through USUB/PSUB
+        if jobID.startswith("zoo:"):
+            self.send(json.dumps({"message": "Invalid job identifier"}))
+            return
+        self.finished.discard(jobID)
+        self.filters[jobID]=eventFilter
+        if replay>0:
+            self.replaying[jobID]=[]
+        await self.pubsub.subscribe(jobID)
+        self.subscribed.set()
+        if replay>0:
+            await self.replay(jobID,replay)
+
+    async def psubscribe(self,pattern,eventFilter="all"):
+        # Only the jobs of the user are matched, through the user channel
+        user=getUser()
+        if user is None:
+            self.send(json.dumps({"message": "No authenticated user"}))
+            return
+        self.patterns[pattern]=eventFilter
+        await self.pubsub.subscribe(userChannel(user))
+        self.subscribed.set()
+
+    async def usubscribe(self,eventFilter="all"):
+        user=getUser()
+        if user is None:
+            self.send(json.dumps({"message": "No authenticated user"}))
+            return
+        # Not replayed, the channel is shared by all the jobs of the user
+        self.filters[userChannel(user)]=eventFilter
+        await self.pubsub.subscribe(userChannel(user))
+        self.subscribed.set()
 
-t0 = threading.Thread(target=receive)
-t0.start()
+    def userFilters(self,channel,jobID):
+        """
+        Return the event filters of the USUB and PSUB commands matching a job
+        published on the user channel.
+        """
+        filters=[]
+        if channel in self.filters:
+            filters.append(self.filters[channel])
+        filters+=[self.patterns[p] for p in self.patterns if fnmatch.fnmatchcase(jobID,p)]
+        return filters
 
-t0.join()
+    async def replay(self,jobID,count):
+        """
+        Send the last count events of the job, then the live messages
+        received meanwhile which were not part of them.
+        """
+        try:
+            entries=await self.redis.xrevrange(streamKey(jobID),count=count)
+        except redis.RedisError:
+            entries=[]
+        held=self.replaying.pop(jobID,[])
+        replayed=set()
+        for entryID, fields in reversed(entries):
+            data=decode(fields[b"data"])
+            replayed.add(data)
+            await self.deliver(jobID,data)
+        self.replayed[jobID]=replayed
+        for data in held:
+            await self.live(jobID,data)
+
+    async def live(self,jobID,data):
+        if jobID in self.replayed:
+            if data in self.replayed[jobID]:
+                return
+            # Anything published from now on is newer than the replay
+            del self.replayed[jobID]
+        await self.deliver(jobID,data)
+
+    async def deliver(self,jobID,data):
+        if jobID in self.finished:
+            return
+        if jobID.startswith("zoo:user:"):
+            await self.deliverUser(jobID,data)
+            return
+        final=isFinal(parseEvent(data))
+        if accept(self.filters.get(jobID,"all"),final):
+            self.emit(jobID,data,final)
+        if final:
+            self.finished.add(jobID)
+            self.replayed.pop(jobID,None)
+            await self.pubsub.unsubscribe(jobID)
+
+    async def deliverUser(self,channel,data):
+        """
+        Forward an envelope published on the user channel, the job is only
+        known from it as the final results and exceptions do not name it.
+        """
+        envelope=parseEvent(data)
+        if envelope is None or not(isinstance(envelope.get("jobID"),str)) \
+           or not(isinstance(envelope.get("data"),str)):
+            return
+        final=isFinal(parseEvent(envelope["data"]))
+        if any(accept(f,final) for f in self.userFilters(channel,envelope["jobID"])):
+            self.emit((channel,envelope["jobID"]),data,final)
+
+    async def handle(self,raw_message):
+        if raw_message["type"]=="subscribe":
+            # Acknowledge the subscription, the client then starts the job.
+            # The data is the number of subscriptions of the connection, so a
+            # fixed value is sent whatever the subscriptions made before.
+            self.send("1")
+        elif raw_message["type"]=="unsubscribe":
+            # The count of a late acknowledgement may be 0 while a new
+            # subscription is already pending, rely on the live state instead
+            if not(self.pubsub.subscribed):
+                self.subscribed.clear()
+        elif raw_message["type"]=="message":
+            channel=decode(raw_message["channel"])
+            data=decode(raw_message["data"])
+            if channel in self.replaying:
+                self.replaying[channel].append(data)
+            else:
+                await self.live(channel,data)
+
+    async def listen(self):
+        while True:
+            await self.subscribed.wait()
+            raw_message=await self.pubsub.get_message(timeout=1.0)
+            if raw_message is not None:
+                await self.handle(raw_message)
+
+    async def receive(self,reader):
+        while True:
+            t=(await reader.readline()).decode('utf-8').strip()
+            if not t:
+                break
+            t1=t.split(" ")
+            if t1[0]=="SUB" and len(t1)>1:
+                count, eventFilter = parseOptions(t1[2:])
+                await self.subscribe(t1[1],count,eventFilter)
+            elif t1[0]=="PSUB" and len(t1)>1:
+                await self.psubscribe(t1[1],parseOptions(t1[2:])[1])
+            elif t1[0]=="USUB":
+                await self.usubscribe(parseOptions(t1[1:])[1])
+            else:
+                self.send(t)
+
+    async def close(self):
+        await self.outbox.join()
+        await self.pubsub.reset()
+
+
+async def main():
+    loop=asyncio.get_running_loop()
+    reader=asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),sys.stdin)
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin,sys.stdout)
+    writer=asyncio.StreamWriter(transport,protocol,None,loop)
+    subscriber=Subscriber(getRedis(),writer)
+    tasks=[asyncio.create_task(subscriber.listen()),asyncio.create_task(subscriber.write())]
+    try:
+        receive=asyncio.create_task(subscriber.receive(reader))
+        overflow=asyncio.create_task(subscriber.outbox.overflow.wait())
+        tasks+=[receive,overflow]
+        await asyncio.wait([receive,overflow],return_when=asyncio.FIRST_COMPLETED)
+        if overflow.done():
+            # The client does not keep up, even with the progress dropped
+            print("Outbound buffer full, closing the connection",file=sys.stderr)
+        else:
+            receive.result()
+            await subscriber.close()
+    finally:
+        for task in tasks:
+            task.cancel()
 
+if __name__=="__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+#
+# Copyright 2026 GeoLabs SARL. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including with
+# out limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Checks of the delivery of the messages published on the user channel to
+# the USUB and PSUB subscriptions of subscriber.py, without a Redis server.
+#
+# example usage:
+# python -m unittest test_subscriber.py
+#
+
+import asyncio
+import json
+import os
+import unittest
+
+import subscriber
+from publisher import userChannel, userMessage
+
+PROGRESS = json.dumps({"jobID": "job-1", "status": "running", "progress": 10})
+PROGRESS2 = json.dumps({"jobID": "job-1", "status": "running", "progress": 50})
+# Final results and exceptions do not carry the identifier of the job
+FINAL = json.dumps({"outputs": {"Result": {"value": "done"}}})
+
+
+class PubSub:
+    """
+    Record the channels subscribed by the subscriber.
+    """
+
+    def __init__(self):
+        self.channels = set()
+        self.subscribed = False
+
+    async def subscribe(self, channel):
+        self.channels.add(channel)
+        self.subscribed = True
+
+    async def unsubscribe(self, channel):
+        self.channels.discard(channel)
+        self.subscribed = bool(self.channels)
+
+
+class Redis:
+
+    def pubsub(self):
+        return PubSub()
+
+
+class UserChannelTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        os.environ["REMOTE_USER"] = "alice"
+        self.coalesce = subscriber.COALESCE
+        subscriber.COALESCE = 60
+        self.sub = subscriber.Subscriber(Redis(), None)
+        self.channel = userChannel("alice")
+
+    async def asyncTearDown(self):
+        subscriber.COALESCE = self.coalesce
+        del os.environ["REMOTE_USER"]
+
+    def messages(self):
+        return [json.loads(item[1]) for item in self.sub.outbox.items]
+
+    async def publish(self, jobID, message):
+        await self.sub.live(self.channel, userMessage(jobID, message))
+
+    async def test_psub_final(self):
+        await self.sub.psubscribe("job-*", "final")
+        await self.publish("job-1", PROGRESS)
+        await self.publish("other", FINAL)
+        await self.publish("job-1", FINAL)
+        self.assertEqual(self.messages(), [{"jobID": "job-1", "data": FINAL}])
+
+    async def test_usub_coalescing(self):
+        await self.sub.usubscribe()
+        await self.publish("job-1", PROGRESS)
+        await self.publish("job-1", PROGRESS2)
+        await self.publish("job-1", FINAL)
+        # The progress waiting for its window is dropped by the final result
+        self.assertEqual(self.sub.pending, {})
+        self.assertEqual(self.messages(), [{"jobID": "job-1", "data": PROGRESS},
+                                           {"jobID": "job-1", "data": FINAL}])
+
+    async def test_unwrapped_message(self):
+        await self.sub.usubscribe()
+        await self.sub.live(self.channel, PROGRESS)
+        self.assertEqual(self.messages(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
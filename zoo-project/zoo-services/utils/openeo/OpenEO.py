@@ -25,36 +25,282 @@ import zoo
 import sys
 print("OK",file=sys.stderr)
 
-def generateInputs(inputs):
+def getParameterSchemas(graphFile):
+    """
+    Return the schemas of the parameters declared by the process graph, keyed
+    by parameter name.
+    """
+    import json
+    graph=json.load(open(graphFile))
     ret={}
+    for parameter in graph.get("parameters",[]):
+        ret[parameter["name"]]=parameter.get("schema",{})
+    return ret
+
+def getTypes(schema):
+    types=schema.get("type",[])
+    if not(isinstance(types,list)):
+        types=[types]
+    return types
+
+def convertBoundingBox(value,crs=None):
+    """
+    Convert a bounding box given as a JSON object or as a minx,miny,maxx,maxy
+    string to the OpenEO bounding-box object.
+    """
+    import json
+    if isinstance(value,str) and value.strip().startswith("{"):
+        return json.loads(value)
+    if isinstance(value,str):
+        value=value.split(",")
+    coordinates=[float(x) for x in value[:4]]
+    ret={"west": coordinates[0], "south": coordinates[1], "east": coordinates[2], "north": coordinates[3]}
+    if crs is not None:
+        ret["crs"]=crs
+    return ret
+
+def convertValue(value,schema,crs=None):
+    """
+    Convert the value of an input to the type given by its schema, a list of
+    schemas is tried in order.
+    """
+    import json
+    from datetime import datetime
+    if isinstance(schema,list):
+        for candidate in schema:
+            try:
+                return convertValue(value,candidate,crs)
+            except (ValueError,TypeError,KeyError,IndexError):
+                pass
+        raise ValueError("Unable to convert the value "+str(value)+" to any of the expected types")
+    if "anyOf" in schema or "oneOf" in schema:
+        return convertValue(value,schema.get("anyOf",schema.get("oneOf")),crs)
+    types=getTypes(schema)
+    if value is None:
+        if "null" in types:
+            return None
+        raise ValueError("A value is required")
+    if types==["null"]:
+        raise ValueError("No value expected")
+    if schema.get("subtype")=="bounding-box":
+        return convertBoundingBox(value,crs)
+    if "array" in types:
+        if isinstance(value,str):
+            value=json.loads(value) if value.strip().startswith("[") else value.split(",")
+        return [convertValue(x,schema.get("items",{}),crs) for x in value]
+    if "object" in types:
+        return json.loads(value) if isinstance(value,str) else value
+    if "boolean" in types:
+        if isinstance(value,bool):
+            return value
+        if str(value).lower() not in ["true","false","1","0"]:
+            raise ValueError("Invalid boolean: "+str(value))
+        return str(value).lower() in ["true","1"]
+    if "integer" in types:
+        return int(value)
+    if "number" in types:
+        return float(value)
+    if schema.get("subtype") in ["date-time","date"] or schema.get("format") in ["date-time","date"]:
+        # Checked here, the parser takes care of the temporal types
+        datetime.fromisoformat(str(value).replace("Z","+00:00"))
+        return str(value)
+    return value
+
+def saveArray(conf,name,value):
+    """
+    Hand a large numeric array over as a .npy file rather than inline, return
+    the reference to use in place of the value. Raise ValueError for the
+    arrays which are not numeric (mixed, nested or string values), numpy
+    would store them as pickled objects which can't be memory mapped.
+    """
+    import numpy
+    array=numpy.asarray(value)
+    if array.dtype.kind not in "biuf":
+        raise ValueError("Not a numeric array: "+str(array.dtype))
+    path=conf["main"]["tmpPath"]+"/"+conf["lenv"]["usid"]+"_"+name+".npy"
+    numpy.save(path,array,allow_pickle=False)
+    return {"npy": path}
+
+def generateInputs(inputs,schemas=None,conf=None):
+    """
+    Build the typed parameters for the graph from the inputs, using the schema
+    of the graph parameters when available and the dataType otherwise.
+    """
+    import json
+    if schemas is None:
+        schemas={}
+    ret={}
+    threshold=int(getPoolSettings(conf)["arrayThreshold"]) if conf is not None else 0
     for i in inputs:
-        if "dataType" in inputs[i]:
-            if inputs[i]["dataType"]=="number":
+        if "value" not in inputs[i] or i=="OpenEOGraph":
+            continue
+        if i in schemas:
+            ret[i]=convertValue(inputs[i]["value"],schemas[i],inputs[i].get("crs"))
+            if threshold>0 and isinstance(ret[i],list) and len(ret[i])>=threshold:
                 try:
-                    ret[i]=float(inputs[i]["value"])
-                except:
-                    ret[i]=int(inputs[i]["value"])
+                    ret[i]=saveArray(conf,i,ret[i])
+                except (ImportError,ValueError,TypeError):
+                    pass
+        elif "dataType" in inputs[i]:
+            if inputs[i]["dataType"] in ["number","float","double"]:
+                ret[i]=float(inputs[i]["value"])
+            elif inputs[i]["dataType"]=="integer":
+                ret[i]=int(inputs[i]["value"])
+            elif inputs[i]["dataType"]=="boolean":
+                ret[i]=inputs[i]["value"].lower()=="true"
+            else:
+                ret[i]=inputs[i]["value"]
     return ret
 
+# Array result format for each supported output mimeType
+resultFormats={
+    "application/x-netcdf": "netcdf",
+    "application/netcdf": "netcdf",
+    "application/zip": "zarr",
+    "image/tiff": "gtiff"
+}
+
+def cleanInputs(parameters):
+    """
+    Remove the .npy files the arrays of the parameters were handed over in.
+    """
+    import os
+    for name in parameters:
+        value=parameters[name]
+        if isinstance(value,dict) and list(value.keys())==["npy"]:
+            try:
+                os.unlink(value["npy"])
+            except OSError:
+                pass
+
+def getPoolSettings(conf):
+    settings={"pool": "true", "workers": "2", "socket": conf["main"]["tmpPath"]+"/openeo_run.sock",
+              "dask": "local", "daskScheduler": "tcp://127.0.0.1:8786", "daskWorkers": "2", "daskThreads": "2",
+              "resultFormat": "netcdf", "arrayThreshold": "100000"}
+    if "openeo" in conf:
+        for key in settings:
+            if key in conf["openeo"]:
+                settings[key]=conf["openeo"][key]
+    return settings
+
+def startPool(conf,settings):
+    """
+    Start the pool of warm openeo_run.py workers in the background, it is
+    detached from the current process and outlives it.
+    """
+    import subprocess,json
+    log=open(settings["socket"]+".log","a")
+    subprocess.Popen(["python",conf["lenv"]["cwd"]+"/openeo_run.py","--serve",settings["socket"],settings["workers"],json.dumps(settings)],
+                     stdin=subprocess.DEVNULL,stdout=log,stderr=log,start_new_session=True)
+    log.close()
+
+def sendToPool(conf,request,start=True):
+    """
+    Send a request to the warm worker pool and return its reply, or False if
+    no pool is available (starting it when start is set).
+    """
+    import socket,json
+    settings=getPoolSettings(conf)
+    if settings["pool"]!="true":
+        return False
+    client=socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        client.connect(settings["socket"])
+    except OSError:
+        client.close()
+        if start:
+            startPool(conf,settings)
+        return False
+    stream=client.makefile("rw")
+    stream.write(json.dumps(request)+"\n")
+    stream.flush()
+    reply=stream.readline()
+    stream.close()
+    client.close()
+    if not(reply):
+        raise Exception("The OpenEO worker closed the connection")
+    reply=json.loads(reply)
+    if reply["status"]!="ok":
+        raise Exception(reply["message"])
+    return reply
+
+def getResultFormat(conf,outputs):
+    """
+    Pick the array result format from the requested output mimeType, or from
+    the [openeo] resultFormat setting.
+    """
+    if "mimeType" in outputs["result"]:
+        mimeType=outputs["result"]["mimeType"].split(";")[0].strip()
+        if mimeType in resultFormats:
+            return resultFormats[mimeType]
+    return getPoolSettings(conf)["resultFormat"]
+
+def runInPool(conf,graphFile,parameters,resultStorage,resultFormat=None):
+    """
+    Send the execution to the warm worker pool and return the description of
+    the result, or False if no pool is available.
+    """
+    return sendToPool(conf,{"graph": graphFile, "parameters": parameters, "result": resultStorage, "format": resultFormat})
+
+def validateGraph(conf,graphFile):
+    """
+    Check that a graph parses and only uses processes known by the registry,
+    raise an exception otherwise. Without a running pool, only the graph
+    syntax is checked.
+    """
+    if sendToPool(conf,{"action": "validate", "graph": graphFile},False):
+        return
+    try:
+        from openeo_pg_parser_networkx import OpenEOProcessGraph
+    except ImportError:
+        return
+    OpenEOProcessGraph.from_file(graphFile)
+
 def run(conf,inputs,outputs):
     print(inputs,file=sys.stderr)
+    parameters={}
     try:
-        print(inputs,file=sys.stderr)
-        import subprocess,json
-        print(json.dumps(generateInputs(inputs)),file=sys.stderr)
+        import subprocess,json,os
+        graphFile=inputs["OpenEOGraph"]["cache_file"]
+        parameters=generateInputs(inputs,getParameterSchemas(graphFile),conf)
+        print(json.dumps(parameters),file=sys.stderr)
         resultStorage=conf["main"]["tmpPath"]+"/"+conf["lenv"]["usid"]
-        command = 'python '+conf["lenv"]["cwd"]+"/openeo_run.py " + resultStorage + " "+inputs["OpenEOGraph"]["cache_file"]
-        process = subprocess.Popen(command.split()+[json.dumps(generateInputs(inputs))], stdout=subprocess.PIPE)
-        output, error = process.communicate()
-        print("OUTPUT",file=sys.stderr)
-        print(output,file=sys.stderr)
-        print("ERROR",file=sys.stderr)
-        print(error,file=sys.stderr)
-        outputs["result"]["value"]=open(resultStorage,"r").read()
+        resultFormat=getResultFormat(conf,outputs)
+        result=runInPool(conf,graphFile,parameters,resultStorage,resultFormat)
+        if not(result):
+            # No warm worker available (yet), run in a dedicated process
+            settings=getPoolSettings(conf)
+            settings["resultFormat"]=resultFormat
+            if settings["dask"]=="local":
+                # The pool cluster is not up either, only attach to an external one
+                settings["dask"]="none"
+            # The request goes through a pipe, never on the command line
+            request={"graph": graphFile, "parameters": parameters, "result": resultStorage, "settings": settings}
+            process = subprocess.Popen(["python",conf["lenv"]["cwd"]+"/openeo_run.py","--run"],
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            output, error = process.communicate(json.dumps(request).encode("utf-8"))
+            print("OUTPUT",file=sys.stderr)
+            print(output,file=sys.stderr)
+            print("ERROR",file=sys.stderr)
+            print(error,file=sys.stderr)
+            if process.returncode!=0:
+                raise Exception("The OpenEO graph execution failed")
+            result=json.loads(output.decode("utf-8").strip().split("\n")[-1])
+        if "mimeType" in result:
+            # Array results are returned from the file written by the worker
+            outputs["result"]["generated_file"]=result["file"]
+            outputs["result"]["mimeType"]=result["mimeType"]
+        else:
+            f=open(result["file"],"r")
+            outputs["result"]["value"]=f.read()
+            f.close()
+            os.unlink(result["file"])
         print(outputs,file=sys.stderr)
         return zoo.SERVICE_SUCCEEDED
     except Exception as e:
         print(e,file=sys.stderr)
-        conf["lenv"]["message"]=e
+        conf["lenv"]["message"]=str(e)
         return zoo.SERVICE_FAILED
-
+    finally:
+        # The arrays are only read while the graph runs
+        cleanInputs(parameters)
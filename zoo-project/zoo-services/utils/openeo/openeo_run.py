@@ -24,47 +24,297 @@
 from openeo_pg_parser_networkx import OpenEOProcessGraph
 import sys
 import os
-original=os.dup(1)
-os.close(1)
-
-#print(inputs,file=sys.stderr)
-#parsed_graph = OpenEOProcessGraph.from_file(inputs["OpenEOGraph"]["cache_file"])
-print(sys.argv,file=sys.stderr)
-parsed_graph = OpenEOProcessGraph.from_file(sys.argv[2])
-import importlib
-import inspect
-from openeo_pg_parser_networkx import ProcessRegistry
-from openeo_processes_dask.process_implementations.core import process
-from openeo_pg_parser_networkx.process_registry import Process
-
-process_registry = ProcessRegistry(wrap_funcs=[process])
-
-# Import these pre-defined processes from openeo_processes_dask and register them into registry
-processes_from_module = [
-    func
-    for _, func in inspect.getmembers(
-        importlib.import_module("openeo_processes_dask.process_implementations"),
-        inspect.isfunction,
-        )
-]
-
-specs_module = importlib.import_module("openeo_processes_dask.specs")
-specs = {
-    func.__name__: getattr(specs_module, func.__name__)
-    for func in processes_from_module
+import json
+from collections import OrderedDict
+
+# Compiled graphs kept by a warm worker, keyed by graph file
+callables=OrderedDict()
+maxCallables=64
+# Client attached to the shared Dask cluster, if any
+client=None
+
+# File extension and mimeType for each array result format
+resultFormats={
+    "netcdf": (".nc","application/x-netcdf"),
+    "zarr": (".zarr.zip","application/zip"),
+    "gtiff": (".tif","image/tiff; application=geotiff")
 }
 
-for func in processes_from_module:
-    process_registry[func.__name__] = Process(
-        spec=specs[func.__name__], implementation=func
-        )
-    
-pg_callable = parsed_graph.to_callable(process_registry=process_registry)
-
-#print(pg_callable(named_parameters={"f":90.0}))
-os.dup2(original,1)
-os.close(original)
-#print(pg_callable(named_parameters=eval(sys.argv[2])))
-f=open(sys.argv[1],"w")
-f.write(str(pg_callable(named_parameters=eval(sys.argv[3]))))
-f.close()
+def buildRegistry():
+    """
+    Create the ProcessRegistry holding the processes from
+    openeo_processes_dask, this is the slow part to keep warm.
+    """
+    import importlib
+    import inspect
+    from openeo_pg_parser_networkx import ProcessRegistry
+    from openeo_processes_dask.process_implementations.core import process
+    from openeo_pg_parser_networkx.process_registry import Process
+
+    process_registry = ProcessRegistry(wrap_funcs=[process])
+
+    # Import these pre-defined processes from openeo_processes_dask and register them into registry
+    processes_from_module = [
+        func
+        for _, func in inspect.getmembers(
+            importlib.import_module("openeo_processes_dask.process_implementations"),
+            inspect.isfunction,
+            )
+    ]
+
+    specs_module = importlib.import_module("openeo_processes_dask.specs")
+    specs = {
+        func.__name__: getattr(specs_module, func.__name__)
+        for func in processes_from_module
+    }
+
+    for func in processes_from_module:
+        process_registry[func.__name__] = Process(
+            spec=specs[func.__name__], implementation=func
+            )
+    return process_registry
+
+def compileGraph(process_registry,graphFile):
+    """
+    Parse the graph and resolve its processes against the registry, fails on
+    an invalid graph or on a process missing from the registry.
+    """
+    parsed_graph = OpenEOProcessGraph.from_file(graphFile)
+    results_cache = {}
+    pg_callable = parsed_graph.to_callable(process_registry=process_registry,results_cache=results_cache)
+    return pg_callable, results_cache
+
+def getCallable(process_registry,graphFile):
+    """
+    Return the compiled graph, parsed again only when the file has changed
+    since (redeployed graphs are renamed over the previous ones).
+    """
+    stat=os.stat(graphFile)
+    version=(stat.st_mtime_ns,stat.st_size,stat.st_ino)
+    if graphFile in callables and callables[graphFile][0]==version:
+        callables.move_to_end(graphFile)
+        return callables[graphFile][1]
+    compiled=compileGraph(process_registry,graphFile)
+    callables[graphFile]=(version,compiled)
+    if len(callables)>maxCallables:
+        callables.popitem(last=False)
+    return compiled
+
+def getClient(settings):
+    """
+    Attach to the shared Dask cluster, started by the pool ("local") or run
+    elsewhere ("external"), so that the graph evaluation uses it rather than
+    the default scheduler of this process.
+    """
+    global client
+    if settings.get("dask","none")=="none":
+        return None
+    if client is not None and client.status=="running":
+        return client
+    try:
+        from dask.distributed import Client
+        client=Client(settings["daskScheduler"],timeout=5,set_as_default=True)
+    except Exception as e:
+        print("Unable to attach to the Dask cluster: "+str(e),file=sys.stderr)
+        client=None
+    return client
+
+def runCluster(settings):
+    """
+    Run the shared LocalCluster, this process only waits for it to be
+    stopped.
+    """
+    import signal
+    import time
+    from dask.distributed import LocalCluster
+    host, port = settings["daskScheduler"].split("://")[-1].rsplit(":",1)
+    cluster=LocalCluster(host=host,scheduler_port=int(port),
+                         n_workers=int(settings["daskWorkers"]),
+                         threads_per_worker=int(settings["daskThreads"]),
+                         dashboard_address=None)
+
+    def stop(signum,frame):
+        cluster.close()
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM,stop)
+    while True:
+        time.sleep(3600)
+
+def writeResult(result,resultFile,resultFormat):
+    """
+    Write the result of a graph and return its description. Arrays are
+    written chunk by chunk in resultFormat to a file next to resultFile,
+    other results are written as text in resultFile.
+    """
+    if hasattr(result,"to_netcdf") and resultFormat in resultFormats:
+        extension, mimeType = resultFormats[resultFormat]
+        path=resultFile+extension
+        if resultFormat=="netcdf":
+            result.to_netcdf(path)
+        elif resultFormat=="zarr":
+            import zarr
+            store=zarr.storage.ZipStore(path,mode="w")
+            try:
+                result.to_zarr(store)
+            finally:
+                store.close()
+        else:
+            import rioxarray
+            result.rio.to_raster(path,tiled=True,lock=True)
+        return {"file": path, "mimeType": mimeType}
+    f=open(resultFile,"w")
+    f.write(str(result))
+    f.close()
+    return {"file": resultFile}
+
+def loadParameters(parameters):
+    """
+    Load the arrays handed over as .npy files, memory mapped.
+    """
+    ret={}
+    for name in parameters:
+        value=parameters[name]
+        if isinstance(value,dict) and list(value.keys())==["npy"]:
+            import numpy
+            value=numpy.load(value["npy"],mmap_mode="r",allow_pickle=False)
+        ret[name]=value
+    return ret
+
+def runGraph(process_registry,graphFile,parameters,resultFile,settings={}):
+    getClient(settings)
+    parameters=loadParameters(parameters)
+    pg_callable, results_cache = getCallable(process_registry,graphFile)
+    # Node results from a previous run must not leak into this one
+    results_cache.clear()
+    try:
+        return writeResult(pg_callable(named_parameters=parameters),resultFile,
+                           settings.get("resultFormat","netcdf"))
+    finally:
+        results_cache.clear()
+
+def handleRequest(process_registry,connection,settings):
+    """
+    Run the graph requested on the connection, one JSON object per line:
+    {"graph": ..., "parameters": ..., "result": ..., "format": ...}, or only
+    validate it when the request is {"action": "validate", "graph": ...}.
+    """
+    stream=connection.makefile("rw")
+    try:
+        request=json.loads(stream.readline())
+        if request.get("action")=="validate":
+            compileGraph(process_registry,request["graph"])
+            reply={"status": "ok"}
+        else:
+            runSettings=dict(settings)
+            if request.get("format") is not None:
+                runSettings["resultFormat"]=request["format"]
+            reply=runGraph(process_registry,request["graph"],request["parameters"],request["result"],runSettings)
+            reply["status"]="ok"
+    except Exception as e:
+        print(e,file=sys.stderr)
+        reply={"status": "error", "message": str(e)}
+    try:
+        stream.write(json.dumps(reply)+"\n")
+        stream.flush()
+    except OSError:
+        pass
+    stream.close()
+    connection.close()
+
+def worker(process_registry,server,settings):
+    while True:
+        connection, address = server.accept()
+        handleRequest(process_registry,connection,settings)
+
+def serve(socketPath,workers=2,settings={}):
+    """
+    Start a pool of pre-warmed worker processes sharing the registry built
+    once before forking, all accepting requests on the same unix socket.
+    When settings["dask"] is "local", a LocalCluster shared by the workers is
+    started in its own process.
+    """
+    import fcntl
+    import signal
+    import socket
+    lock=open(socketPath+".lock","w")
+    try:
+        fcntl.flock(lock,fcntl.LOCK_EX|fcntl.LOCK_NB)
+    except OSError:
+        # Another pool is already serving this socket
+        return
+    process_registry=buildRegistry()
+    if os.path.exists(socketPath):
+        os.unlink(socketPath)
+    server=socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    # Only the user running the ZOO-Kernel may send requests to the pool
+    umask=os.umask(0o177)
+    try:
+        server.bind(socketPath)
+    finally:
+        os.umask(umask)
+    os.chmod(socketPath,0o600)
+    server.listen(workers*4)
+    children=[]
+    cluster=[]
+
+    def fork(target):
+        pid=os.fork()
+        if pid==0:
+            signal.signal(signal.SIGTERM,signal.SIG_DFL)
+            try:
+                target()
+            finally:
+                os._exit(0)
+        return pid
+
+    def startWorker():
+        return fork(lambda: worker(process_registry,server,settings))
+
+    def startCluster():
+        return fork(lambda: runCluster(settings))
+
+    def stop(signum,frame):
+        for pid in children+cluster:
+            try:
+                os.kill(pid,signal.SIGTERM)
+            except OSError:
+                pass
+        server.close()
+        os.unlink(socketPath)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM,stop)
+    if settings.get("dask","none")=="local":
+        cluster.append(startCluster())
+    for i in range(workers):
+        children.append(startWorker())
+    while True:
+        # Replace any worker or cluster which died
+        pid, status = os.wait()
+        if pid in children:
+            children.remove(pid)
+            children.append(startWorker())
+        elif pid in cluster:
+            cluster.remove(pid)
+            cluster.append(startCluster())
+
+if __name__=="__main__":
+    if sys.argv[1]=="--serve":
+        # The pool never writes to stdout, it gets detached from the caller
+        os.dup2(sys.stderr.fileno(),1)
+        serve(sys.argv[2],int(sys.argv[3]) if len(sys.argv)>3 else 2,
+              json.loads(sys.argv[4]) if len(sys.argv)>4 else {})
+    elif sys.argv[1]=="--run":
+        # The request is read from stdin, only the description of the result
+        # is written to stdout
+        request=json.load(sys.stdin)
+        original=os.dup(1)
+        os.dup2(sys.stderr.fileno(),1)
+        process_registry=buildRegistry()
+        result=runGraph(process_registry,request["graph"],request["parameters"],request["result"],
+                        request.get("settings",{}))
+        sys.stdout.flush()
+        os.dup2(original,1)
+        os.close(original)
+        print(json.dumps(result))
@@ -22,30 +22,537 @@
 #  DEALINGS IN THE SOFTWARE.
 ################################################################################
 import zoo
-import urllib.request
+import urllib.parse
+import http.client
+import email.utils
+import hashlib
+import os
+import re
+import shutil
 import sys
 import json
+import threading
+import time
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections to the STAC/raster/vector backends,
+    shared by every request handled by the same worker process.
+    """
+
+    def __init__(self, maxIdle=4, timeout=30):
+        self.maxIdle = maxIdle
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def _key(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        return (parsed.scheme, parsed.netloc)
+
+    def _connect(self, key):
+        if key[0] == "https":
+            return http.client.HTTPSConnection(key[1], timeout=self.timeout)
+        return http.client.HTTPConnection(key[1], timeout=self.timeout)
+
+    def request(self, url, method="GET", body=None, headers=None, redirects=5):
+        """
+        Send a request and return the response object, the caller must call
+        release() once the body has been fully consumed.
+        """
+        key = self._key(url)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        parsed = urllib.parse.urlsplit(url)
+        target = urllib.parse.urlunsplit(("", "", parsed.path or "/", parsed.query, ""))
+        for attempt in range(2):
+            with self.lock:
+                pool = self.idle.get(key, [])
+                reused = attempt == 0 and len(pool) > 0
+                connection = pool.pop() if reused else None
+            if connection is None:
+                connection = self._connect(key)
+            try:
+                connection.request(method, target, body=body, headers=headers or {})
+                response = connection.getresponse()
+                break
+            except (http.client.HTTPException, ConnectionError, OSError):
+                connection.close()
+                # A pooled connection may have been closed by the backend
+                # while idle, retry once on a fresh one.
+                if not(reused) or attempt > 0:
+                    raise
+        response.zooPoolKey = key
+        response.zooConnection = connection
+        if response.status in (301, 302, 303, 307, 308) and redirects > 0:
+            location = urllib.parse.urljoin(url, response.getheader("Location", ""))
+            self.release(response)
+            if response.status == 303:
+                method, body = "GET", None
+            return self.request(location, method, body, headers, redirects - 1)
+        if response.status >= 400:
+            reason = response.reason
+            self.release(response)
+            raise Exception("HTTP Error %d: %s (%s)" % (response.status, reason, url))
+        return response
+
+    def release(self, response):
+        """
+        Give the connection back to the pool once the remaining body has been
+        drained, or close it if the backend asked to.
+        """
+        if not(response.isclosed()):
+            response.read()
+        connection = response.zooConnection
+        with self.lock:
+            pool = self.idle.setdefault(response.zooPoolKey, [])
+            if not(response.will_close) and len(pool) < self.maxIdle:
+                pool.append(connection)
+                return
+        connection.close()
+
+class ResponseCache:
+    """
+    Size-bounded on-disk cache of the backend responses, evicting the least
+    recently used entries first. Every entry is stored as <key>.data for the
+    raw body and <key>.json for its metadata, both replaced atomically so
+    that the cache can be shared by all the workers.
+    """
+
+    def __init__(self, path, maxSize, defaultTtl=0):
+        self.path = path
+        self.maxSize = maxSize
+        self.defaultTtl = defaultTtl
+        # Running size of the cache, None until the first scan. The entries
+        # stored by the other workers are only accounted for by the scans,
+        # done when the size exceeds maxSize or every scanInterval stores.
+        self.size = None
+        self.scanInterval = 100
+        self.stores = 0
+        if not(os.path.isdir(path)):
+            os.makedirs(path, exist_ok=True)
+
+    def key(self, url, accept=""):
+        parsed = urllib.parse.urlsplit(url)
+        query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)))
+        normalized = urllib.parse.urlunsplit((parsed.scheme.lower(), parsed.netloc.lower(), parsed.path or "/", query, ""))
+        return hashlib.sha256((normalized + "\n" + accept).encode("utf-8")).hexdigest()
+
+    def lookup(self, key):
+        try:
+            with open(os.path.join(self.path, key + ".json"), "r") as f:
+                entry = json.load(f)
+            if not(os.path.exists(entry["file"])):
+                return None
+            # Touch the entry to keep track of its last use
+            os.utime(entry["file"])
+            return entry
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def isFresh(self, entry):
+        return entry["expires"] > time.time()
+
+    def freshness(self, headers):
+        """
+        Return the freshness lifetime in seconds of a response, or None if it
+        must not be stored.
+        """
+        directives = {}
+        for item in (headers.get("Cache-Control") or "").split(","):
+            item = item.strip().lower()
+            if item:
+                name, _, value = item.partition("=")
+                directives[name] = value.strip('"')
+        if "no-store" in directives or "private" in directives:
+            return None
+        if "no-cache" in directives:
+            return 0
+        for name in ["s-maxage", "max-age"]:
+            if name in directives:
+                try:
+                    return max(0, int(directives[name]))
+                except ValueError:
+                    return 0
+        if headers.get("Expires") is not None:
+            try:
+                expires = email.utils.parsedate_to_datetime(headers.get("Expires")).timestamp()
+                return max(0, int(expires - time.time()))
+            except (TypeError, ValueError):
+                return 0
+        return self.defaultTtl
+
+    def store(self, key, url, response, chunkSize=65536):
+        """
+        Stream the response body in the cache and return the new entry, or
+        None if the response can not be stored (the body is then left
+        unread).
+        """
+        ttl = self.freshness(response.headers)
+        if ttl is None or response.status != 200:
+            return None
+        etag = response.headers.get("ETag")
+        lastModified = response.headers.get("Last-Modified")
+        if ttl == 0 and etag is None and lastModified is None:
+            return None
+        entry = {
+            "url": url,
+            "file": os.path.join(self.path, key + ".data"),
+            "contentType": response.headers.get_content_type(),
+            "charset": response.headers.get_content_charset() or "utf-8",
+            "etag": etag,
+            "lastModified": lastModified,
+            "cacheControl": response.headers.get("Cache-Control"),
+            "expires": time.time() + ttl,
+            "size": 0,
+        }
+        tmpFile = entry["file"] + "." + str(os.getpid())
+        with open(tmpFile, "wb") as f:
+            chunk = response.read(chunkSize)
+            while chunk:
+                f.write(chunk)
+                entry["size"] += len(chunk)
+                chunk = response.read(chunkSize)
+        try:
+            previous = os.path.getsize(entry["file"])
+        except OSError:
+            previous = 0
+        os.replace(tmpFile, entry["file"])
+        self.save(key, entry)
+        self.stores += 1
+        if self.size is not None:
+            self.size += entry["size"] - previous
+        if self.size is None or self.size > self.maxSize or self.stores >= self.scanInterval:
+            self.evict()
+        return entry
+
+    def refresh(self, key, entry, headers):
+        """
+        Update an entry after a successful revalidation (304 Not Modified).
+        """
+        ttl = self.freshness(headers)
+        if ttl is None:
+            ttl = 0
+        entry["expires"] = time.time() + ttl
+        for name, field in [("ETag", "etag"), ("Last-Modified", "lastModified"), ("Cache-Control", "cacheControl")]:
+            if headers.get(name) is not None:
+                entry[field] = headers.get(name)
+        self.save(key, entry)
+        return entry
+
+    def save(self, key, entry):
+        metaFile = os.path.join(self.path, key + ".json")
+        with open(metaFile + "." + str(os.getpid()), "w") as f:
+            json.dump(entry, f)
+        os.replace(metaFile + "." + str(os.getpid()), metaFile)
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not(name.endswith(".data")):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries += [(stat.st_mtime, stat.st_size, name[:-5])]
+            total += stat.st_size
+        entries.sort()
+        for mtime, size, key in entries:
+            if total <= self.maxSize:
+                break
+            for extension in [".json", ".data"]:
+                try:
+                    os.unlink(os.path.join(self.path, key + extension))
+                except OSError:
+                    pass
+            total -= size
+        self.size = total
+        self.stores = 0
+
+pool = None
+cache = None
+rewriters = {}
+landing = {"key": None, "expires": 0, "conformsTo": None}
+
+def getPool(conf):
+    global pool
+    if pool is None:
+        pool = ConnectionPool(
+            maxIdle=int(conf["eoapi"].get("poolSize", "4")),
+            timeout=float(conf["eoapi"].get("timeout", "30")),
+        )
+    return pool
+
+def getCache(conf):
+    global cache
+    if conf["eoapi"].get("cache", "true") == "false":
+        return None
+    if cache is None:
+        cache = ResponseCache(
+            conf["eoapi"].get("cachePath", conf["main"]["tmpPath"] + "/eoapi-cache"),
+            int(conf["eoapi"].get("cacheSize", "256")) * 1024 * 1024,
+            int(conf["eoapi"].get("cacheTtl", "0")),
+        )
+    return cache
+
+def isTextContent(contentType):
+    return contentType.startswith("text/") or \
+        contentType.count("json") > 0 or \
+        contentType.count("xml") > 0 or \
+        contentType.count("javascript") > 0
+
+def getRewriter(conf, path, apiDoc=False):
+    """
+    Return a function rewriting the backend URLs of a text response in one
+    pass, the compiled expression is cached per route.
+    """
+    rootPath = "/" + conf["openapi"]["rootPath"]
+    key = (rootPath, path, apiDoc, conf["eoapi"]["proxyFor"],
+           conf["eoapi"]["proxyForRaster"], conf["eoapi"]["proxyForVector"])
+    if key in rewriters:
+        return rewriters[key]
+    backends = [
+        (conf["eoapi"]["proxyFor"], "stac"),
+        (conf["eoapi"]["proxyForRaster"], "raster"),
+        (conf["eoapi"]["proxyForVector"], "vector"),
+    ]
+    # Longest URL first so that a backend URL being the prefix of another
+    # one can not shadow it
+    backends.sort(key=lambda x: len(x[0]), reverse=True)
+    patterns = []
+    replacements = []
+    for url, name in backends:
+        # Backends already serving under our root path (i.e. titiler with a
+        # root_path set) must not get the prefix twice
+        patterns += [re.escape(url) + "(?:" + re.escape(rootPath + "/" + name) + "(?=/))?" + \
+                     "(?:/openapi\\.json)?"]
+        replacements += [rootPath + "/" + name]
+    prefix = rootPath + "/" + path
+    if apiDoc:
+        # Paths already exposed under our root path are left untouched
+        patterns += ['"/(?!' + re.escape(rootPath[1:] + "/") + ")"]
+        replacements += ['"' + prefix + "/"]
+    patterns += [re.escape("/openapi.json")]
+    replacements += [prefix + "/openapi.json"]
+    expression = re.compile("|".join(["(" + x + ")" for x in patterns]))
+
+    def replace(match):
+        value = replacements[match.lastindex - 1]
+        if match.lastindex <= len(backends) and match.group(0).endswith("/openapi.json"):
+            return value + "/openapi.json"
+        return value
+
+    rewriters[key] = lambda text: expression.sub(replace, text)
+    return rewriters[key]
+
+def setCacheHeaders(conf,entry):
+    for name, field in [("ETag", "etag"), ("Last-Modified", "lastModified"), ("Cache-Control", "cacheControl")]:
+        if entry.get(field) is not None:
+            conf["headers"][name]=entry[field]
+
+def notModified(conf,etag):
+    if etag is None or "HTTP_IF_NONE_MATCH" not in conf["renv"]:
+        return False
+    tags=[x.strip() for x in conf["renv"]["HTTP_IF_NONE_MATCH"].split(",")]
+    return "*" in tags or etag in tags or etag.replace("W/","",1) in [x.replace("W/","",1) for x in tags]
+
+def writeResponse(conf,path,apiDoc,response):
+    conf["headers"]["Content-Type"] = response.headers.get_content_type()
+    setCacheHeaders(conf,{"etag": response.headers.get("ETag"),
+                          "lastModified": response.headers.get("Last-Modified"),
+                          "cacheControl": response.headers.get("Cache-Control")})
+    if not(isTextContent(conf["headers"]["Content-Type"])):
+        # Binary content (tiles, images, ...) is streamed as-is to the
+        # response file without being kept in memory
+        fileName=conf["main"]["tmpPath"]+"/"+conf["lenv"]["usid"]+".data"
+        chunkSize=int(conf["eoapi"].get("chunkSize","65536"))
+        size=0
+        with open(fileName, "wb") as binary_file:
+            chunk=response.read(chunkSize)
+            while chunk:
+                binary_file.write(chunk)
+                size+=len(chunk)
+                chunk=response.read(chunkSize)
+        conf["headers"]["Content-Length"]=str(size)
+        conf["lenv"]["response_generated_file"]=fileName
+    else:
+        charset=response.headers.get_content_charset() or "utf-8"
+        conf["lenv"]["response"]=getRewriter(conf,path,apiDoc)(response.read().decode(charset))
+
+def writeCachedResponse(conf,path,apiDoc,entry):
+    conf["headers"]["Content-Type"]=entry["contentType"]
+    setCacheHeaders(conf,entry)
+    if not(isTextContent(entry["contentType"])):
+        # The kernel removes the response file once sent, so hand it a link
+        # to the cached body rather than the cached file itself
+        fileName=conf["main"]["tmpPath"]+"/"+conf["lenv"]["usid"]+".data"
+        try:
+            os.link(entry["file"],fileName)
+        except OSError:
+            shutil.copyfile(entry["file"],fileName)
+        conf["headers"]["Content-Length"]=str(entry["size"])
+        conf["lenv"]["response_generated_file"]=fileName
+    else:
+        with open(entry["file"],"rb") as f:
+            conf["lenv"]["response"]=getRewriter(conf,path,apiDoc)(f.read().decode(entry["charset"]))
+
+def getRequestBody(conf):
+    """
+    Return the method, body and headers to use for the upstream request.
+    """
+    method=conf["renv"].get("REQUEST_METHOD","GET").upper()
+    if method not in ["POST","PUT","PATCH"]:
+        return ("GET",None,{})
+    body=conf["renv"].get("jrequest")
+    if body is None and "request" in conf:
+        body=conf["request"].get("jrequest")
+    return (method,body,{"Content-Type": conf["renv"].get("CONTENT_TYPE","application/json")})
+
+def getStreamMode(conf,url):
+    """
+    Return the streaming mode requested by the client (ndjson or
+    itemcollection) and the upstream URL without the stream parameter.
+    """
+    parsed=urllib.parse.urlsplit(url)
+    query=urllib.parse.parse_qsl(parsed.query,keep_blank_values=True)
+    mode=None
+    for name, value in query:
+        if name=="stream" and value in ["ndjson","itemcollection"]:
+            mode=value
+    if mode is None and conf["renv"].get("HTTP_ACCEPT","").count("application/x-ndjson")>0:
+        mode="ndjson"
+    if len([x for x in query if x[0]=="stream"])==0:
+        return (mode,url)
+    query=[x for x in query if x[0]!="stream"]
+    return (mode,urllib.parse.urlunsplit((parsed.scheme,parsed.netloc,parsed.path,urllib.parse.urlencode(query,safe=",:/"),"")))
+
+def getNextPage(page,method,body):
+    """
+    Return the url, method and body to fetch the next page, as given by the
+    STAC API next link, or None when the last page was reached.
+    """
+    for link in page.get("links",[]):
+        if link.get("rel")!="next" or "href" not in link:
+            continue
+        nextMethod=link.get("method","GET").upper()
+        if nextMethod=="GET":
+            return (link["href"],"GET",None)
+        nextBody=body
+        if "body" in link:
+            if link.get("merge",False) and body is not None:
+                merged=json.loads(body)
+                merged.update(link["body"])
+                nextBody=json.dumps(merged)
+            else:
+                nextBody=json.dumps(link["body"])
+        return (link["href"],nextMethod,nextBody)
+    return None
+
+def harvest(conf,path,mode,url,method,body,headers):
+    """
+    Follow the next links lazily and write the items page after page to the
+    response file, as NDJSON or as a single ItemCollection, so that only one
+    page is kept in memory at a time.
+    """
+    rewrite=getRewriter(conf,path)
+    fileName=conf["main"]["tmpPath"]+"/"+conf["lenv"]["usid"]+".data"
+    maxPages=int(conf["eoapi"].get("streamMaxPages","0"))
+    visited=set()
+    count=0
+    pages=0
+    with open(fileName,"w",encoding="utf-8") as output:
+        if mode=="itemcollection":
+            output.write('{"type":"FeatureCollection","features":[')
+        nextPage=(url,method,body)
+        while nextPage is not None and (nextPage[0],nextPage[2]) not in visited:
+            visited.add((nextPage[0],nextPage[2]))
+            url,method,body=nextPage
+            response=getPool(conf).request(url,method,body,headers if body is not None else {})
+            try:
+                page=json.loads(response.read().decode(response.headers.get_content_charset() or "utf-8"))
+            finally:
+                getPool(conf).release(response)
+            features=page.get("features",[])
+            for feature in features:
+                if mode=="ndjson":
+                    output.write(rewrite(json.dumps(feature))+"\n")
+                else:
+                    output.write(("," if count>0 else "")+rewrite(json.dumps(feature)))
+                count+=1
+            pages+=1
+            if len(features)==0 or (maxPages>0 and pages>=maxPages):
+                break
+            nextPage=getNextPage(page,method,body)
+        if mode=="itemcollection":
+            output.write('],"numberReturned":'+str(count)+'}')
+    conf["headers"]["Content-Type"]="application/x-ndjson" if mode=="ndjson" else "application/geo+json"
+    conf["headers"]["Content-Length"]=str(os.path.getsize(fileName))
+    conf["lenv"]["response_generated_file"]=fileName
 
 def route(conf,path,rootUrl):
-    req=urllib.request.Request(
-            url=rootUrl+(conf["renv"]["REDIRECT_QUERY_STRING"].replace(path+"/","").replace("&","?",1))
-            )
+    queryString=conf["renv"]["REDIRECT_QUERY_STRING"]
+    url=rootUrl+(queryString.replace(path+"/","").replace("&","?",1))
+    apiDoc=queryString.count("openapi.json")>0 or queryString.count("/api")>0
     try:
-        response = urllib.request.urlopen(req)
-        conf["headers"]["Content-Type"] = response.headers.get_content_type()
-        if conf["headers"]["Content-Type"].count("image")>0:
-            conf["headers"]["Content-Length"]=response.headers.get("content-length")
-            #conf["lenv"]["response"]=str(response.read())
-            #conf["lenv"]["response_size"]=response.headers.get("content-length")
-            with open(conf["main"]["tmpPath"]+"/"+conf["lenv"]["usid"]+".data", "wb") as binary_file:
-                binary_file.write(response.read())
-                binary_file.close()
-            conf["lenv"]["response_generated_file"]=conf["main"]["tmpPath"]+"/"+conf["lenv"]["usid"]+".data"
-        else:
-            conf["lenv"]["response"]=response.read().decode("utf-8").replace(conf["eoapi"]["proxyFor"],"/"+conf["openapi"]["rootPath"]+"/stac").replace(conf["eoapi"]["proxyForRaster"],"/"+conf["openapi"]["rootPath"]+"/raster").replace(conf["eoapi"]["proxyForVector"],"/"+conf["openapi"]["rootPath"]+"/vector").replace("/openapi.json","/"+conf["openapi"]["rootPath"]+"/"+path+"/openapi.json")#.replace("/collections/","/"+conf["openapi"]["rootPath"]+"/"+path+"/collections/").replace("/info","/info?assets=visual")
-            if conf["renv"]["REDIRECT_QUERY_STRING"].count("openapi.json")>0 or conf["renv"]["REDIRECT_QUERY_STRING"].count("/api")>0:
-                conf["lenv"]["response"]=conf["lenv"]["response"].replace("\"/","\"/"+conf["openapi"]["rootPath"]+"/"+path+"/")
-            conf["lenv"]["response"]=conf["lenv"]["response"].replace("/ogc-api/raster/ogc-api/raster/","/ogc-api/raster/")
+        method,body,requestHeaders=getRequestBody(conf)
+        mode,url=getStreamMode(conf,url)
+        if mode is not None:
+            harvest(conf,path,mode,url,method,body,requestHeaders)
+            conf["headers"]["status"]="200 OK"
+            return zoo.SERVICE_SUCCEEDED
+        if method!="GET":
+            # Request bodies (i.e. POST /search) are forwarded as-is and the
+            # responses never cached
+            response=getPool(conf).request(url,method,body,requestHeaders)
+            try:
+                writeResponse(conf,path,apiDoc,response)
+            finally:
+                getPool(conf).release(response)
+            conf["headers"]["status"]="200 OK"
+            return zoo.SERVICE_SUCCEEDED
+        responseCache=getCache(conf)
+        entry=None
+        if responseCache is not None:
+            key=responseCache.key(url,conf["renv"].get("HTTP_ACCEPT",""))
+            entry=responseCache.lookup(key)
+        if entry is None or not(responseCache.isFresh(entry)):
+            headers={}
+            if entry is not None:
+                # Conditional revalidation of the stale entry
+                if entry["etag"] is not None:
+                    headers["If-None-Match"]=entry["etag"]
+                if entry["lastModified"] is not None:
+                    headers["If-Modified-Since"]=entry["lastModified"]
+            elif "HTTP_IF_NONE_MATCH" in conf["renv"]:
+                headers["If-None-Match"]=conf["renv"]["HTTP_IF_NONE_MATCH"]
+            response = getPool(conf).request(url,headers=headers)
+            try:
+                if response.status==304 and entry is not None:
+                    entry=responseCache.refresh(key,entry,response.headers)
+                elif response.status==304:
+                    # The client already holds the current version
+                    setCacheHeaders(conf,{"etag": response.headers.get("ETag"),
+                                          "cacheControl": response.headers.get("Cache-Control")})
+                    conf["lenv"]["response"]=""
+                    conf["headers"]["status"]="304 Not Modified"
+                    return zoo.SERVICE_SUCCEEDED
+                else:
+                    entry=None
+                    if responseCache is not None:
+                        entry=responseCache.store(key,url,response,int(conf["eoapi"].get("chunkSize","65536")))
+                    if entry is None:
+                        writeResponse(conf,path,apiDoc,response)
+            finally:
+                getPool(conf).release(response)
+        if entry is not None:
+            if notModified(conf,entry["etag"]):
+                setCacheHeaders(conf,entry)
+                conf["lenv"]["response"]=""
+                conf["headers"]["status"]="304 Not Modified"
+                return zoo.SERVICE_SUCCEEDED
+            writeCachedResponse(conf,path,apiDoc,entry)
     except Exception as e:
         conf["lenv"]["message"]=str(e)
         print("---- ERROR\n",file=sys.stderr)
@@ -68,27 +575,64 @@ def eoapiRoute(conf,inputs,outputs):
             return route(conf,"vector",conf["eoapi"]["proxyForVector"])
     return zoo.SERVICE_SUCCEEDED
 
+def landingKey(conf):
+    """
+    Fingerprint of the configuration the merged conformance depends on, so
+    that the cached value is dropped whenever the configuration is reloaded.
+    """
+    key=[conf["openapi"]["rootUrl"],conf["openapi"]["rootPath"],
+         conf["eoapi"]["proxyFor"],conf["eoapi"]["proxyForRaster"],conf["eoapi"]["proxyForVector"]]
+    if "CONTEXT_DOCUMENT_ROOT" in conf["renv"]:
+        for name in ["main.cfg","oas.cfg"]:
+            try:
+                key+=[str(os.stat(conf["renv"]["CONTEXT_DOCUMENT_ROOT"]+"/"+name).st_mtime)]
+            except OSError:
+                pass
+    return "|".join(key)
+
+def fetchJson(conf,url,path=None):
+    response=getPool(conf).request(url,headers={"Accept": "application/json"})
+    try:
+        content=response.read().decode(response.headers.get_content_charset() or "utf-8")
+    finally:
+        getPool(conf).release(response)
+    if path is not None:
+        content=getRewriter(conf,path)(content)
+    return json.loads(content)
+
+def getConformsTo(conf):
+    """
+    Return the STAC conformance classes merged with the OGC API - Processes
+    ones, fetching both documents concurrently once the cached list expired.
+    """
+    key=landingKey(conf)
+    if landing["key"]==key and landing["expires"]>time.time():
+        return landing["conformsTo"]
+    from concurrent.futures import ThreadPoolExecutor
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            processing=executor.submit(fetchJson,conf,conf["openapi"]["rootUrl"]+"/conformance")
+            stac=executor.submit(fetchJson,conf,conf["eoapi"]["proxyFor"]+"/","stac")
+            conformsTo=[]
+            for value in stac.result().get("conformsTo",[])+processing.result().get("conformsTo",[]):
+                if value not in conformsTo:
+                    conformsTo+=[value]
+    except Exception as e:
+        if landing["key"]!=key or landing["conformsTo"] is None:
+            raise
+        # Keep serving the previous value until the backends are back
+        print(e,file=sys.stderr)
+        return landing["conformsTo"]
+    landing["key"]=key
+    landing["expires"]=time.time()+int(conf["eoapi"].get("conformanceTtl","300"))
+    landing["conformsTo"]=conformsTo
+    return conformsTo
+
 def securityOut(conf,inputs,outputs):
     try:
         if len(conf["renv"]["REDIRECT_QUERY_STRING"])==1:
-            req=urllib.request.Request(
-                    conf["openapi"]["rootUrl"]+"/conformance"
-                    )
-            response = urllib.request.urlopen(req)
-            tmpResponseProcessing=response.read().decode("utf-8")
-            req=urllib.request.Request(
-                    url=conf["eoapi"]["proxyFor"]+"/"
-                    )
-            response = urllib.request.urlopen(req)
-            tmpResponse=response.read().decode("utf-8").replace(conf["eoapi"]["proxyFor"],"/"+conf["openapi"]["rootPath"]+"/stac").replace(conf["eoapi"]["proxyForRaster"],"/"+conf["openapi"]["rootPath"]+"/raster").replace(conf["eoapi"]["proxyForVector"],"/"+conf["openapi"]["rootPath"]+"/vector")
-            jsonObjectFetched=json.loads(tmpResponse)
             jsonObjectResponse=json.loads(conf["lenv"]["json_response_object"])
-            jsonObjectProcesses=json.loads(tmpResponseProcessing)
-            for a in range(len(jsonObjectProcesses["conformsTo"])):
-                jsonObjectFetched["conformsTo"]+=[(jsonObjectProcesses["conformsTo"][a])]
-            for a in jsonObjectFetched:
-                if a=="conformsTo":
-                    jsonObjectResponse[a]=jsonObjectFetched[a]
+            jsonObjectResponse["conformsTo"]=getConformsTo(conf)
             conf["lenv"]["json_response_object"]=json.dumps(jsonObjectResponse)
             return zoo.SERVICE_SUCCEEDED
     except Exception as e:
@@ -25,6 +25,7 @@ import zoo
 import sys
 import os
 import shutil
+from zcfg_util import ZcfgWriter, atomic_write
 
 def openeoFilterIn(conf,inputs,outputs):
     if "servicesNamespace" in conf and "debug" in conf["servicesNamespace"]:
@@ -79,24 +80,24 @@ def writeZcfgFromProcessDescription(conf,obj):
         conf["lenv"]["ecode"]="http://www.opengis.net/def/exceptions/ogcapi-processes-2/1.0/duplicated-process"
         conf["lenv"]["message"]=zoo._("The process is already deployed (from OpenEO).")
         return zoo.SERVICE_FAILED
-    zcfgFile=open(conf["auth_env"]["cwd"]+prefixPath+processName+".zcfg","w")
-    zcfgFile.write("["+processName+"]\n")
+    zcfg=ZcfgWriter()
+    zcfg.line("["+processName+"]")
     if "title" in processDescription:
-        zcfgFile.write(" Title = "+ processDescription["title"] + "\n")
+        zcfg.line(" Title = "+ processDescription["title"])
     else:
-        zcfgFile.write(" Title = Not provided\n")
+        zcfg.line(" Title = Not provided")
     if "description" in processDescription:
-        zcfgFile.write(" Abstract = "+ processDescription["description"] + "\n")
+        zcfg.line(" Abstract = "+ processDescription["description"])
     else:
-        zcfgFile.write(" Abstract = Not provided\n")
+        zcfg.line(" Abstract = Not provided")
     if "version" in processDescription:
-        zcfgFile.write(" processVersion = "+processDescription["version"] + "\n")
+        zcfg.line(" processVersion = "+processDescription["version"])
     else:
-        zcfgFile.write(" processVersion = 0.0.1 \n")
+        zcfg.line(" processVersion = 0.0.1 ")
     if "type" in executionUnit and executionUnit["type"]!="application/cwl":
         if executionUnit["type"]=="SLURM":
-            zcfgFile.write(" serviceType = HPC \n")
-            zcfgFile.write(" serviceProvider = "+ processDescription["id"] + "\n")
+            zcfg.line(" serviceType = HPC ")
+            zcfg.line(" serviceProvider = "+ processDescription["id"])
             # We should invoke the DeployOnHpc service asynchronously from here
             # An option would be to use WPS 1.0.0 and the following URL:
             # zoo_loader.cgi.resquest=Execute&service=WPS&version=1.0.0&\
@@ -106,31 +107,39 @@ def writeZcfgFromProcessDescription(conf,obj):
             # execution only on the ZOO-FPM.
         else:
             if executionUnit["type"].count("openeo")>0:
-                zcfgFile.write(" serviceType = Python \n")
-                zcfgFile.write(" serviceProvider = "+ processDescription["id"] + "\n")
-                zcfgFile.write(" serviceSubType = OpenEO\n")
-                # Write the graph if any
+                zcfg.line(" serviceType = Python ")
+                zcfg.line(" serviceProvider = "+ processDescription["id"])
+                zcfg.line(" serviceSubType = OpenEO")
+                # Write the graph if any, once validated
                 if "value" in executionUnit:
                     import json
-                    graphFile=open(conf["auth_env"]["cwd"]+prefixPath+processName+"_graph.json","w")
-                    graphFile.write(json.dumps(executionUnit["value"]))
-                    graphFile.close()
-    zcfgFile.write(" mutable = true\n")
+                    try:
+                        atomic_write(conf["auth_env"]["cwd"]+prefixPath+processName+"_graph.json",
+                                     json.dumps(executionUnit["value"]),
+                                     lambda graphFile: validateGraph(conf,graphFile))
+                    except Exception as e:
+                        if "headers" not in conf:
+                            conf["headers"]={}
+                        conf["headers"]["status"]="400 Bad Request"
+                        conf["lenv"]["code"]="InvalidParameterValue"
+                        conf["lenv"]["message"]=zoo._("The OpenEO process graph is invalid: ")+str(e)
+                        return zoo.SERVICE_FAILED
+    zcfg.line(" mutable = true")
     if "additionalParameters" in processDescription:
-        zcfgFile.write(" <AdditionalParameters>\n")
+        zcfg.line(" <AdditionalParameters>")
         for c in range(len(processDescription["additionalParameters"]["parameters"])):
-            zcfgFile.write("  "+processDescription["additionalParameters"]["parameters"][c]["name"] + \
-                               " = "+ \
-                               str(processDescription["additionalParameters"]["parameters"][c]["value"][0]) \
-                               +"\n")
-        zcfgFile.write(" </AdditionalParameters>\n")
-    zcfgFile.write(" <DataInputs>\n")
-    writeZcfgInputs(zcfgFile,processDescription["inputs"])
-    zcfgFile.write(" </DataInputs>\n")
-    zcfgFile.write(" <DataOutputs>\n")
-    writeZcfgOutputs(zcfgFile,processDescription["outputs"])
-    zcfgFile.write(" </DataOutputs>\n")
-    zcfgFile.close()
+            zcfg.line("  "+processDescription["additionalParameters"]["parameters"][c]["name"] + \
+                          " = "+ \
+                          str(processDescription["additionalParameters"]["parameters"][c]["value"][0]))
+        zcfg.line(" </AdditionalParameters>")
+    zcfg.line(" <DataInputs>")
+    writeZcfgInputs(zcfg,processDescription["inputs"])
+    zcfg.line(" </DataInputs>")
+    zcfg.line(" <DataOutputs>")
+    writeZcfgOutputs(zcfg,processDescription["outputs"])
+    zcfg.line(" </DataOutputs>")
+    # Written at once, so that workers never load a partial zcfg
+    zcfg.save(conf["auth_env"]["cwd"]+prefixPath+processName+".zcfg")
     # Set the desired lenv keys to bypass the execution of the Deploy process
     conf["lenv"]["isDeployed"]="true"
     conf["lenv"]["Identifier"]=conf["servicesNamespace"]["deploy_service_provider"]
@@ -142,120 +151,99 @@ def writeZcfgFromProcessDescription(conf,obj):
         conf["headers"]["status"]="204 No Content"
     return 0
 
-def writeZcfgOutputs(zcfgFile,outputs):
+def validateGraph(conf,graphFile):
+    """
+    Check the graph before deploying it, using the warm OpenEO workers when
+    they are running, so that a broken graph fails here rather than at its
+    first execution.
+    """
+    try:
+        import OpenEO
+    except ImportError:
+        return
+    OpenEO.validateGraph(conf,graphFile)
+
+def writeZcfgOutputs(zcfg,outputs):
     for id in outputs:
-        zcfgFile.write(" ["+id+"]\n")
+        zcfg.line(" ["+id+"]")
         if "title" in outputs[id]:
-            zcfgFile.write(" Title = "+ outputs[id]["title"] + "\n")
+            zcfg.line(" Title = "+ outputs[id]["title"])
         else:
-            zcfgFile.write(" Title = Not provided\n")
+            zcfg.line(" Title = Not provided")
         if "description" in outputs[id]:
-            zcfgFile.write(" Abstract = "+ outputs[id]["title"] + "\n")
+            zcfg.line(" Abstract = "+ outputs[id]["title"])
         else:
-            zcfgFile.write(" Abstract = Not provided\n")
+            zcfg.line(" Abstract = Not provided")
         if "additionalParameters" in outputs[id]:
-            zcfgFile.write(" <AdditionalParameters>\n")
+            zcfg.line(" <AdditionalParameters>")
             for c in range(len(outputs[id]["additionalParameters"]["parameters"])):
-                zcfgFile.write("  "+outputs[id]["additionalParameters"]["parameters"][c]["name"] + \
-                                " = "+ \
-                                outputs[id]["additionalParameters"]["parameters"][c]["value"][0] \
-                                +"\n")
-            zcfgFile.write(" </AdditionalParameters>\n")
-        writeZcfgDataType(zcfgFile,outputs[id]["schema"])
+                zcfg.line("  "+outputs[id]["additionalParameters"]["parameters"][c]["name"] + \
+                              " = "+ \
+                              outputs[id]["additionalParameters"]["parameters"][c]["value"][0])
+            zcfg.line(" </AdditionalParameters>")
+        writeZcfgDataType(zcfg,outputs[id]["schema"])
 
-def writeZcfgInputs(zcfgFile,inputs):
+def writeZcfgInputs(zcfg,inputs):
     for id in inputs:
-        zcfgFile.write(" ["+id+"]\n")
+        zcfg.line(" ["+id+"]")
         if "title" in inputs[id]:
-            zcfgFile.write("  Title = "+ inputs[id]["title"] + "\n")
+            zcfg.line("  Title = "+ inputs[id]["title"])
         else:
-            zcfgFile.write("  Title = Not provided\n")
+            zcfg.line("  Title = Not provided")
         if "description" in inputs[id]:
-            zcfgFile.write("  Abstract = "+ inputs[id]["title"] + "\n")
+            zcfg.line("  Abstract = "+ inputs[id]["title"])
         else:
-            zcfgFile.write("  Abstract = Not provided\n")
+            zcfg.line("  Abstract = Not provided")
         if not("minOccurs" in inputs and "maxOccurs" in inputs):
-            zcfgFile.write("  minOccurs = 1\n")
-            zcfgFile.write("  maxOccurs = 1\n")
+            zcfg.line("  minOccurs = 1")
+            zcfg.line("  maxOccurs = 1")
         else:
             if not("minOccurs" in inputs[id]) and not("schema" in inputs[id] and "nullable" in inputs[id]["schema"]):
-                zcfgFile.write("  minOccurs = 1\n")
+                zcfg.line("  minOccurs = 1")
             else:
                 if not("schema" in inputs[id] and "nullable" in inputs[id]["schema"]):
-                    zcfgFile.write("  minOccurs = "+ str(inputs[id]["minOccurs"]) +" \n")
+                    zcfg.line("  minOccurs = "+ str(inputs[id]["minOccurs"]) +" ")
                 else:
-                    zcfgFile.write("  minOccurs = 0 \n")
+                    zcfg.line("  minOccurs = 0 ")
             if not("maxOccurs" in inputs):
-                zcfgFile.write("  minOccurs = 1\n")
+                zcfg.line("  minOccurs = 1")
             else:
-                zcfgFile.write("  maxOccurs = "+ str(inputs[id]["maxOccurs"]) +" \n")
+                zcfg.line("  maxOccurs = "+ str(inputs[id]["maxOccurs"]) +" ")
         if "additionalParameters" in inputs[id]:
-            zcfgFile.write("  <AdditionalParameters>\n")
+            zcfg.line("  <AdditionalParameters>")
             for c in range(len(inputs[id]["additionalParameters"]["parameters"])):
-                zcfgFile.write("   "+inputs[id]["additionalParameters"]["parameters"][c]["name"] + \
-                                " = "+ \
-                                inputs[id]["additionalParameters"]["parameters"][c]["value"][0] \
-                                +"\n")
-            zcfgFile.write("  </AdditionalParameters>\n")
-        writeZcfgDataType(zcfgFile,inputs[id]["schema"],prefix=1)
+                zcfg.line("   "+inputs[id]["additionalParameters"]["parameters"][c]["name"] + \
+                              " = "+ \
+                              inputs[id]["additionalParameters"]["parameters"][c]["value"][0])
+            zcfg.line("  </AdditionalParameters>")
+        writeZcfgDataType(zcfg,inputs[id]["schema"],prefix=1)
 
-def writeZcfgDataType(zcfgFile,schemaObj,prefix=0):
+def writeZcfgDataType(zcfg,schemaObj,prefix=0):
     if "type" in schemaObj:
-        for c in range(prefix):
-            zcfgFile.write(" ")
-        zcfgFile.write(" <LiteralData>\n")
-        for c in range(prefix):
-            zcfgFile.write(" ")
-        zcfgFile.write("  dataType = " + schemaObj["type"] + "\n")
+        zcfg.line(" <LiteralData>",prefix)
+        zcfg.line("  dataType = " + schemaObj["type"],prefix)
         if "enum" in schemaObj:
-            for c in range(prefix):
-                zcfgFile.write(" ")
-            zcfgFile.write("  AllowedValues = ")
-            for i in range(len(schemaObj["enum"])):
-                if i >0:
-                    zcfgFile.write(",")
-                zcfgFile.write(str(schemaObj["enum"][i]))
-            zcfgFile.write("\n")
+            zcfg.line("  AllowedValues = "+",".join([str(x) for x in schemaObj["enum"]]),prefix)
         if "default" in schemaObj:
-            for c in range(prefix):
-                zcfgFile.write(" ")
-            zcfgFile.write("   <Default>\n")
-            for c in range(prefix):
-                zcfgFile.write(" ")
-            zcfgFile.write("    value = " + str(schemaObj["default"]) + "\n")
-            for c in range(prefix):
-                zcfgFile.write(" ")
-            zcfgFile.write("   </Default>\n")
+            zcfg.line("   <Default>",prefix)
+            zcfg.line("    value = " + str(schemaObj["default"]),prefix)
+            zcfg.line("   </Default>",prefix)
         else:
-            for c in range(prefix):
-                zcfgFile.write(" ")
-            zcfgFile.write("   <Default/>\n")
-        for c in range(prefix):
-            zcfgFile.write(" ")
-        zcfgFile.write(" </LiteralData>\n")
+            zcfg.line("   <Default/>",prefix)
+        zcfg.line(" </LiteralData>",prefix)
     else:
         # Guessing that there is no BBOX so we directly utput a ComplexData here
-        for c in range(prefix):
-            zcfgFile.write(" ")
-        zcfgFile.write(" <ComplexData>\n")
+        zcfg.line(" <ComplexData>",prefix)
         if "oneOf" in schemaObj:
             for i in range(len(schemaObj["oneOf"])):
-                for c in range(prefix):
-                    zcfgFile.write(" ")
                 if i==0:
-                    zcfgFile.write("  <Default>\n")
+                    zcfg.line("  <Default>",prefix)
                 else:
-                    zcfgFile.write("  <Supported>\n")
-                for c in range(prefix):
-                    zcfgFile.write(" ")
+                    zcfg.line("  <Supported>",prefix)
                 if "contentMediaType" in schemaObj["oneOf"][i]:
-                    zcfgFile.write("   mimeType = "+schemaObj["oneOf"][i]["contentMediaType"]+"\n")
-                for c in range(prefix):
-                    zcfgFile.write(" ")
+                    zcfg.line("   mimeType = "+schemaObj["oneOf"][i]["contentMediaType"],prefix)
                 if i==0:
-                    zcfgFile.write("  </Default>\n")
+                    zcfg.line("  </Default>",prefix)
                 else:
-                    zcfgFile.write("  </Supported>\n")
-        for c in range(prefix):
-            zcfgFile.write(" ")
-        zcfgFile.write(" </ComplexData>\n")
+                    zcfg.line("  </Supported>",prefix)
+        zcfg.line(" </ComplexData>",prefix)